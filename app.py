@@ -3,10 +3,15 @@ Geeks Andijan HR Bot
 Telegram bot for job applications management
 """
 import telepot
+from telepot.exception import TelegramError
 from telepot.namedtuple import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from flask import Flask, request
+import atexit
+import collections
+import heapq
+import io
+import random
 import sqlite3
-import openpyxl
 import os
 import threading
 import time
@@ -15,7 +20,14 @@ import logging
 import re
 from contextlib import contextmanager
 from typing import Dict, Optional, List, Tuple, Any
-from config import TOKEN, ADMIN_ID, GROUP_ID, SESSION_TIMEOUT, WEBHOOK_SECRET
+from config import (
+    TOKEN, ADMIN_ID, GROUP_ID, SESSION_TIMEOUT, WEBHOOK_SECRET, SEND_WORKERS, SEND_QUEUE_SIZE,
+)
+from db import (
+    ensure_db as migrate_db, normalize_phone, export_applicants_to_excel, export_file_name,
+    APPLICANT_EXPORT_COLUMNS, DB_PATH,
+)
+from ingress import UpdateDeduplicator
 
 # Configure logging
 logging.basicConfig(
@@ -35,16 +47,10 @@ if not WEBHOOK_MODE:
 bot = telepot.Bot(TOKEN)
 app = Flask(__name__)
 
-# User sessions with TTL
-users: Dict[int, Dict[str, Any]] = {}
-user_timeouts: Dict[int, float] = {}
-
 # Constants
 VACANCIES = ["Sotuvchi", "Admin", "Mentor", "Support"]
 MENTOR_SUBJECTS = ["SMM", "Mobilografiya", "Dasturlash"]
 
-# Lock for thread-safe operations
-users_lock = threading.Lock()
 
 
 # === UTILITY FUNCTIONS ===
@@ -57,7 +63,7 @@ def db_connection():
     """
     conn = None
     try:
-        conn = sqlite3.connect("hr_bot.db", timeout=10)
+        conn = sqlite3.connect(DB_PATH, timeout=10)
         conn.row_factory = sqlite3.Row  # Enable column access by name
         yield conn
         conn.commit()
@@ -71,55 +77,107 @@ def db_connection():
             conn.close()
 
 
+class SessionStore:
+    """
+    User sessions with a TTL, safe to use from many request threads.
+
+    Expiry times are kept in a min-heap, so cleanup only looks at sessions
+    that are actually due: O(log n) per update instead of a scan of every
+    session per message. Refreshing a session pushes a new heap entry; the
+    old one is recognised as stale (its time no longer matches) and skipped.
+    An RLock guards everything, so methods may call each other freely.
+    """
+
+    def __init__(self, timeout: float = SESSION_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._data: Dict[int, Dict[str, Any]] = {}
+        self._expires: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def cleanup(self) -> None:
+        """Remove expired sessions (only heap entries that are due are touched)."""
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, uid = heapq.heappop(self._heap)
+                if self._expires.get(uid) == expires_at:
+                    self._data.pop(uid, None)
+                    self._expires.pop(uid, None)
+                    logger.debug(f"Cleaned up expired session for user {uid}")
+
+    def touch(self, chat_id: int) -> None:
+        """Restart the session timeout."""
+        expires_at = time.time() + self.timeout
+        with self._lock:
+            self._expires[chat_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, chat_id))
+            # Stale entries pile up when sessions are refreshed often; rebuild occasionally
+            if len(self._heap) > 2 * len(self._expires) + 64:
+                self._heap = [(t, uid) for uid, t in self._expires.items()]
+                heapq.heapify(self._heap)
+
+    def get(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.cleanup()
+            return self._data.get(chat_id)
+
+    def set(self, chat_id: int, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[chat_id] = data
+            self.touch(chat_id)
+
+    def delete(self, chat_id: int) -> None:
+        with self._lock:
+            self._data.pop(chat_id, None)
+            self._expires.pop(chat_id, None)
+
+
+# User sessions with TTL
+sessions = SessionStore()
+
+# update_ids already handled; kept in the database too, so a redelivery that
+# reaches another worker process (or arrives after a restart) is caught
+processed_updates = UpdateDeduplicator(db_path=DB_PATH)
+
+
 def cleanup_old_users() -> None:
     """
     Remove expired user sessions to prevent memory leaks.
     """
-    current_time = time.time()
-    with users_lock:
-        expired = [
-            uid for uid, timeout in user_timeouts.items()
-            if current_time > timeout
-        ]
-        for uid in expired:
-            users.pop(uid, None)
-            user_timeouts.pop(uid, None)
-            logger.debug(f"Cleaned up expired session for user {uid}")
+    sessions.cleanup()
 
 
 def update_user_timeout(chat_id: int) -> None:
     """
     Update user session timeout.
     """
-    with users_lock:
-        user_timeouts[chat_id] = time.time() + SESSION_TIMEOUT
+    sessions.touch(chat_id)
 
 
 def get_user(chat_id: int) -> Optional[Dict[str, Any]]:
     """
     Get user session data.
     """
-    cleanup_old_users()
-    with users_lock:
-        return users.get(chat_id)
+    return sessions.get(chat_id)
 
 
 def set_user(chat_id: int, data: Dict[str, Any]) -> None:
     """
     Set user session data and update timeout.
     """
-    with users_lock:
-        users[chat_id] = data
-        update_user_timeout(chat_id)
+    sessions.set(chat_id, data)
 
 
 def delete_user(chat_id: int) -> None:
     """
     Delete user session.
     """
-    with users_lock:
-        users.pop(chat_id, None)
-        user_timeouts.pop(chat_id, None)
+    sessions.delete(chat_id)
 
 
 # === VALIDATION FUNCTIONS ===
@@ -176,60 +234,11 @@ def validate_subject(subject: str) -> bool:
 
 def ensure_db() -> None:
     """
-    Create database table if it doesn't exist.
-    Add missing columns if needed for backward compatibility.
+    Create or migrate the database schema.
+    The schema and its versioned migrations live in db.py (shared with the aiogram bot).
     """
     try:
-        with db_connection() as conn:
-            c = conn.cursor()
-            # Create table if not exists
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS applicants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    age TEXT,
-                    phone TEXT,
-                    vacancy TEXT NOT NULL,
-                    subject TEXT,
-                    experience TEXT,
-                    workplace TEXT,
-                    username TEXT,
-                    photo_id TEXT,
-                    cv_file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Check and add missing columns
-            c.execute("PRAGMA table_info(applicants)")
-            existing_cols = {row[1] for row in c.fetchall()}
-            
-            needed_cols = {
-                "name": "TEXT",
-                "age": "TEXT",
-                "phone": "TEXT",
-                "vacancy": "TEXT",
-                "subject": "TEXT",
-                "experience": "TEXT",
-                "workplace": "TEXT",
-                "username": "TEXT",
-                "photo_id": "TEXT",
-                "cv_file_id": "TEXT",
-                "created_at": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
-            }
-            
-            for col, coltype in needed_cols.items():
-                if col not in existing_cols:
-                    try:
-                        logger.info(f"Adding missing column `{col}` to applicants")
-                        if col == "created_at":
-                            c.execute(f"ALTER TABLE applicants ADD COLUMN {col} {coltype}")
-                        else:
-                            c.execute(f"ALTER TABLE applicants ADD COLUMN {col} TEXT")
-                    except Exception as e:
-                        logger.exception("Cannot add column %s: %s", col, e)
-            
-            conn.commit()
+        migrate_db()
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.exception("Error initializing database: %s", e)
@@ -285,9 +294,9 @@ def get_all_applicants(vacancy: Optional[str] = None) -> List[Tuple]:
         with db_connection() as conn:
             c = conn.cursor()
             if vacancy and validate_vacancy(vacancy):
-                c.execute("SELECT * FROM applicants WHERE vacancy=?", (vacancy,))
+                c.execute(f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants WHERE vacancy=?", (vacancy,))
             else:
-                c.execute("SELECT * FROM applicants")
+                c.execute(f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants")
             return c.fetchall()
     except Exception as e:
         logger.exception("Error fetching all applicants: %s", e)
@@ -309,19 +318,22 @@ def save_application(user_data: Dict[str, Any]) -> bool:
             c = conn.cursor()
             c.execute("""
                 INSERT INTO applicants 
-                (name, age, phone, vacancy, subject, experience, workplace, username, photo_id, cv_file_id) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                (name, age, phone, phone_norm, vacancy, subject, experience, workplace, username, photo_id, cv_file_id,
+                 user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 user_data.get("name"),
                 user_data.get("age"),
                 user_data.get("phone"),
+                normalize_phone(user_data.get("phone")),
                 user_data.get("vacancy"),
                 user_data.get("subject"),
                 user_data.get("experience"),
                 user_data.get("workplace"),
                 user_data.get("username"),
                 user_data.get("photo_id"),
-                user_data.get("cv_file_id")
+                user_data.get("cv_file_id"),
+                user_data.get("user_id"),
             ))
             conn.commit()
             return True
@@ -330,41 +342,23 @@ def save_application(user_data: Dict[str, Any]) -> bool:
         return False
 
 
-def export_to_excel(vacancy: Optional[str] = None) -> Optional[str]:
+def export_to_excel(vacancy: Optional[str] = None) -> Optional[Tuple[str, io.BytesIO]]:
     """
-    Export applicants to Excel file.
+    Export applicants to an in-memory Excel file (see db.export_applicants_to_excel).
     
     Args:
         vacancy: Filter by vacancy (optional)
     
     Returns:
-        File path if successful, None otherwise
+        (unique file name, file object) ready for sendDocument, None if there is nothing to export
     """
     try:
-        rows = get_all_applicants(vacancy)
-        if not rows:
+        if vacancy and not validate_vacancy(vacancy):
+            vacancy = None
+        content = export_applicants_to_excel(vacancy)
+        if content is None:
             return None
-        
-        if vacancy:
-            file_name = f"{vacancy}_arizalar.xlsx"
-        else:
-            file_name = "all_arizalar.xlsx"
-        
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Arizalar"
-        
-        # Headers
-        headers = ["ID", "Ism", "Yosh", "Telefon", "Vakansiya", "Yo'nalish", 
-                   "Tajriba", "Ish joyi", "Username", "Rasm", "CV", "Sana"]
-        ws.append(headers)
-        
-        # Data
-        for row in rows:
-            ws.append(row)
-        
-        wb.save(file_name)
-        return file_name
+        return export_file_name("arizalar", vacancy), io.BytesIO(content)
     except Exception as e:
         logger.exception("Error exporting to Excel: %s", e)
         return None
@@ -372,38 +366,219 @@ def export_to_excel(vacancy: Optional[str] = None) -> Optional[str]:
 
 # === MESSAGE SENDING HELPERS ===
 
+class _SendJob:
+    """One queued Bot API call."""
+
+    __slots__ = ("func", "args", "kwargs", "chat_id", "attempt", "max_retries")
+
+    def __init__(self, func, args, kwargs, chat_id, max_retries: int):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.attempt = 0
+        self.max_retries = max_retries
+
+    def run(self) -> None:
+        # A file upload read by a failed attempt is sent again from the start
+        for arg in (*self.args, *self.kwargs.values()):
+            stream = arg[1] if isinstance(arg, tuple) and len(arg) == 2 else arg
+            if hasattr(stream, "seek"):
+                stream.seek(0)
+        self.func(*self.args, **self.kwargs)
+
+
+class _SendShard:
+    """
+    One sender thread and its schedule: a min-heap of (due time, seq, job).
+    Only the oldest job of a chat is ever scheduled; later ones wait in
+    `_chats[chat_id]` until it is sent or given up, so a chat receives its
+    messages in order even while one of them is being retried.
+    """
+
+    def __init__(self, owner: "SendQueue", index: int):
+        self.owner = owner
+        self.index = index
+        self.cond = threading.Condition()
+        self.heap: List[Tuple[float, int, _SendJob]] = []
+        self.seq = 0
+        self.size = 0
+        self._chats: Dict[Any, Any] = {}
+        self.thread: Optional[threading.Thread] = None
+
+    def _schedule(self, job: _SendJob, due: float) -> None:
+        self.seq += 1
+        heapq.heappush(self.heap, (due, self.seq, job))
+        self.cond.notify()
+
+    def put(self, job: _SendJob) -> None:
+        """Queue a job (caller holds self.cond)."""
+        self.size += 1
+        waiting = self._chats.get(job.chat_id)
+        if waiting is None:
+            self._chats[job.chat_id] = collections.deque()
+            self._schedule(job, time.monotonic())
+        else:
+            waiting.append(job)
+
+    def _finish(self, job: _SendJob) -> None:
+        """The job is done: schedule the chat's next one (caller holds self.cond)."""
+        self.size -= 1
+        waiting = self._chats.get(job.chat_id)
+        if waiting:
+            self._schedule(waiting.popleft(), time.monotonic())
+        else:
+            self._chats.pop(job.chat_id, None)
+
+    def _next_job(self) -> Optional[_SendJob]:
+        with self.cond:
+            while True:
+                if self.owner.stopping and not self.heap:
+                    return None
+                now = time.monotonic()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                self.cond.wait(self.heap[0][0] - now if self.heap else None)
+
+    def run(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            delay = self.owner.attempt(job)
+            with self.cond:
+                if delay is None:
+                    self._finish(job)
+                else:
+                    self._schedule(job, time.monotonic() + delay)
+
+
+class SendQueue:
+    """
+    Bot API calls sent by background threads instead of the request thread.
+
+    A webhook request only queues its replies and returns; a failing call is
+    retried later with exponential backoff and jitter, without holding a
+    thread while it waits. Chats are sharded across SEND_WORKERS threads by
+    chat id (one slow chat does not hold up the others), and at most
+    SEND_QUEUE_SIZE calls are kept: when Telegram is unreachable new calls
+    are dropped and counted instead of piling up in memory.
+    """
+
+    def __init__(self, workers: int = SEND_WORKERS, max_pending: int = SEND_QUEUE_SIZE,
+                 retry_base: float = 1.0, retry_max: float = 60.0):
+        self.max_pending = max_pending
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stopping = False
+        self._shards = [_SendShard(self, i) for i in range(max(1, workers))]
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        # Metrics
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return sum(shard.size for shard in self._shards)
+
+    def stats(self) -> Dict[str, int]:
+        """Queue depth and delivery counters (for the health endpoint)."""
+        return {
+            "pending": len(self),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def _ensure_started(self) -> None:
+        # Threads are started lazily and again after a fork (preforking WSGI servers)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for shard in self._shards:
+                shard.thread = threading.Thread(target=shard.run, name=f"send-{shard.index}", daemon=True)
+                shard.thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, func, *args, max_retries: int = 3, **kwargs) -> bool:
+        """Queue func(*args, **kwargs); the first argument is the chat id. False if dropped."""
+        self._ensure_started()
+        chat_id = args[0] if args else kwargs.get("chat_id")
+        shard = self._shards[hash(chat_id) % len(self._shards)]
+        with shard.cond:
+            if self.stopping or len(self) >= self.max_pending:
+                self.dropped += 1
+                logger.error(f"Send queue full, dropped {func.__name__} to {chat_id}")
+                return False
+            shard.put(_SendJob(func, args, kwargs, chat_id, max_retries))
+        return True
+
+    def attempt(self, job: _SendJob) -> Optional[float]:
+        """Run a job once; return the delay before its next attempt, or None if it is done."""
+        name = job.func.__name__
+        try:
+            job.run()
+            self.sent += 1
+            logger.debug(f"Message sent successfully: {name}")
+            return None
+        except Exception as e:
+            job.attempt += 1
+            # 4xx other than 429 (blocked by the user, chat not found, ...) will not go away
+            code = getattr(e, "error_code", None)
+            permanent = isinstance(e, TelegramError) and isinstance(code, int) and 400 <= code < 500 and code != 429
+            if not permanent and job.attempt < job.max_retries:
+                self.retried += 1
+                delay = min(self.retry_max, self.retry_base * 2 ** (job.attempt - 1)) * random.uniform(0.5, 1.5)
+                retry_after = (getattr(e, "json", None) or {}).get("parameters", {}).get("retry_after")
+                if retry_after:
+                    delay = max(delay, float(retry_after))
+                logger.warning(f"Retry {job.attempt}/{job.max_retries} for {name} in {delay:.1f}s: {e}")
+                return delay
+            self.failed += 1
+            logger.error(f"Failed after {job.attempt} attempts for {name}: {e}")
+            # Xatolikni admin'ga yuborish (agar bot.sendMessage bo'lmasa)
+            if name != 'sendMessage':
+                try:
+                    bot.sendMessage(ADMIN_ID, f"❌ {name} xatolik: {str(e)[:500]}")
+                except:
+                    pass
+            return None
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop accepting calls and give queued ones up to `timeout` seconds to go out."""
+        self.stopping = True
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+            if shard.thread is not None and shard.thread.is_alive():
+                shard.thread.join(max(0.0, deadline - time.monotonic()))
+
+
+# Background sender shared by all request threads
+send_queue = SendQueue()
+atexit.register(send_queue.stop)
+
+
 def send_with_retry(func, *args, max_retries: int = 3, **kwargs) -> bool:
     """
-    Send message with retry mechanism.
+    Send a message in the background, retrying failures with backoff.
     
     Args:
         func: Function to call (e.g., bot.sendMessage)
-        *args: Positional arguments
-        max_retries: Maximum number of retry attempts
+        *args: Positional arguments (the first one is the chat id)
+        max_retries: Maximum number of attempts
         **kwargs: Keyword arguments
     
     Returns:
-        True if successful, False otherwise
+        True if queued, False if dropped because the send queue is full
     """
-    for attempt in range(max_retries):
-        try:
-            result = func(*args, **kwargs)
-            logger.debug(f"Message sent successfully: {func.__name__}")
-            return True
-        except Exception as e:
-            logger.warning(f"Retry {attempt + 1}/{max_retries} for {func.__name__}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(1)
-            else:
-                logger.error(f"Failed after {max_retries} attempts for {func.__name__}: {e}")
-                # Xatolikni admin'ga yuborish (agar bot.sendMessage bo'lmasa)
-                if func.__name__ != 'sendMessage':
-                    try:
-                        bot.sendMessage(ADMIN_ID, f"❌ {func.__name__} xatolik: {str(e)[:500]}")
-                    except:
-                        pass
-                return False
-    return False
+    return send_queue.submit(func, *args, max_retries=max_retries, **kwargs)
 
 
 def send_application_to_admin(user_data: Dict[str, Any]) -> None:
@@ -562,8 +737,8 @@ def finish_application(chat_id: int) -> None:
                            "❗ Ariza to'liq emas. Iltimos, /start bilan qaytadan boshlang.")
             return
         
-        # Save to database
-        if save_application(user):
+        # Save to database (private chat: chat_id is the user's id)
+        if save_application({**user, "user_id": chat_id}):
             # Send to admin and group
             send_application_to_admin(user)
             
@@ -767,12 +942,10 @@ def handle(msg: Dict) -> None:
                 parts = text.split()
                 vacancy = parts[1].capitalize() if len(parts) > 1 else None
                 
-                file_name = export_to_excel(vacancy=vacancy)
-                if file_name:
+                document = export_to_excel(vacancy=vacancy)
+                if document:
                     try:
-                        with open(file_name, "rb") as f:
-                            send_with_retry(bot.sendDocument, chat_id, f)
-                        os.remove(file_name)
+                        send_with_retry(bot.sendDocument, chat_id, document)
                     except Exception as e:
                         logger.exception("Error sending Excel file: %s", e)
                         send_with_retry(bot.sendMessage, chat_id,
@@ -796,12 +969,10 @@ def handle(msg: Dict) -> None:
             
             # Admin: Export button
             if chat_id == ADMIN_ID and text == "📤 Export":
-                file_name = export_to_excel()
-                if file_name:
+                document = export_to_excel()
+                if document:
                     try:
-                        with open(file_name, "rb") as f:
-                            send_with_retry(bot.sendDocument, chat_id, f)
-                        os.remove(file_name)
+                        send_with_retry(bot.sendDocument, chat_id, document)
                     except Exception as e:
                         logger.exception("Error sending Excel file: %s", e)
                         send_with_retry(bot.sendMessage, chat_id,
@@ -983,6 +1154,11 @@ def webhook():
             logger.warning("Empty update received")
             return "ok", 200
         
+        # Telegram redelivers after a timeout or an error answer: handle each update once
+        if processed_updates.seen(update.get('update_id')):
+            logger.info(f"Duplicate update {update.get('update_id')} dropped")
+            return "ok", 200
+        
         # Handle regular messages
         if 'message' in update:
             chat_id = update['message'].get('chat', {}).get('id')
@@ -1139,7 +1315,9 @@ def health_check():
             "status": "healthy",
             "database": "connected",
             "applicants_count": count,
-            "active_sessions": len(users)
+            "active_sessions": len(sessions),
+            "send_queue": send_queue.stats(),
+            "dedup": processed_updates.stats(),
         }
     except Exception as e:
         logger.exception("Health check failed: %s", e)
@@ -0,0 +1,61 @@
+"""
+Benchmark: memory held per unfinished form, dict vs slotted draft.
+
+Builds 50k complete HR application drafts both ways and measures them with
+tracemalloc. Field values are created up front and shared by both runs, so
+the numbers are the container overhead per session (what the FSM storage
+keeps on top of the strings the user typed). Also prints the stored JSON
+size of one draft in both encodings.
+
+Usage: python benchmarks/bench_draft_memory.py [drafts]
+"""
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from handlers.forms import ApplicationDraft, encode_data  # noqa: E402
+
+DRAFTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+
+def values(i: int) -> dict:
+    return {
+        "vacancy": "Mentor",
+        "subject": "Dasturlash",
+        "name": f"Applicant {i}",
+        "username": f"user{i}",
+        "age": str(18 + i % 40),
+        "phone": f"+99890{i:07d}",
+        "experience": "3 yil",
+        "workplace": "Geeks",
+        "photo_id": f"AgACAgIAAxkBAAIB{i:040d}",
+        "cv_file_id": f"BQACAgIAAxkBAAIC{i:040d}",
+    }
+
+
+def measure(label: str, build) -> None:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    held = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_session = (after - before) / len(held)
+    print(f"{label:<28} {per_session:>8.0f} B/session {(after - before) / 2**20:>8.1f} MB total")
+
+
+def main() -> None:
+    sources = [values(i) for i in range(DRAFTS)]
+    print(f"{DRAFTS:,} complete HR application drafts (field values excluded)")
+    measure("dict (MemoryStorage)", lambda: [dict(v) for v in sources])
+    measure("ApplicationDraft (slots)", lambda: [ApplicationDraft.from_dict(v) for v in sources])
+
+    sample = sources[0]
+    print(f"stored JSON: dict {len(json.dumps(sample, ensure_ascii=False))} B, "
+          f"draft {len(encode_data(ApplicationDraft.from_dict(sample)))} B")
+
+
+if __name__ == "__main__":
+    main()
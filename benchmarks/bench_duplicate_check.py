@@ -0,0 +1,108 @@
+"""
+Benchmark: 24h duplicate check in save_application at 1M applicant rows.
+
+Compares
+  1. the old query (raw phone, no covering index),
+  2. the indexed query on (phone_norm, vacancy, created_at),
+  3. the in-memory RecentSubmissions window in front of it.
+
+Usage: python benchmarks/bench_duplicate_check.py [rows]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import db  # noqa: E402
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+LOOKUPS = 2000
+VACANCIES = ["Sotuvchi", "Admin", "Mentor", "Support"]
+
+
+def fill(path: str) -> None:
+    """Create the schema and insert ROWS applicants spread over the last 90 days."""
+    conn = sqlite3.connect(path)
+    rnd = random.Random(42)
+
+    def rows():
+        for i in range(ROWS):
+            phone = f"+99890{i:07d}"
+            age_seconds = rnd.randint(0, 90 * 24 * 3600)
+            yield (
+                f"User {i}", "25", phone, db.normalize_phone(phone),
+                rnd.choice(VACANCIES), f"-{age_seconds} seconds",
+            )
+
+    conn.executemany(
+        "INSERT INTO applicants (name, age, phone, phone_norm, vacancy, created_at) "
+        "VALUES (?, ?, ?, ?, ?, datetime('now', ?))",
+        rows(),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def timed(label: str, fn) -> None:
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        fn(i)
+    per_call = (time.perf_counter() - start) / LOOKUPS
+    print(f"{label:<42} {per_call * 1e6:>10.1f} us/check")
+
+
+def main() -> None:
+    tmp = tempfile.mkdtemp()
+    db.DB_PATH = os.path.join(tmp, "bench.db")
+    db.ensure_db()
+    print(f"Filling {ROWS:,} rows...")
+    fill(db.DB_PATH)
+
+    # Never-seen numbers: the common "not a duplicate" case
+    candidates = [f"+99891{i:07d}" for i in range(LOOKUPS)]
+
+    with db.db_connection() as conn:
+        c = conn.cursor()
+
+        def old_query(i):
+            c.execute(
+                "SELECT id FROM applicants WHERE phone = ? AND vacancy = ? "
+                "AND created_at > datetime('now', '-24 hours') LIMIT 1",
+                (candidates[i], "Admin"),
+            )
+            c.fetchone()
+
+        def indexed_query(i):
+            c.execute(
+                "SELECT id FROM applicants WHERE phone_norm = ? AND vacancy = ? "
+                "AND created_at > datetime('now', '-24 hours') LIMIT 1",
+                (candidates[i], "Admin"),
+            )
+            c.fetchone()
+
+        cache = db.RecentSubmissions()
+        start = time.perf_counter()
+        cache.contains(c, "+0", "Admin")  # initial load of the 24h window
+        print(f"RecentSubmissions warm-up: {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+        def cached(i):
+            cache.contains(c, candidates[i], "Admin")
+
+        old_lookups = max(1, LOOKUPS // 100)  # slow; sample fewer
+        start = time.perf_counter()
+        for i in range(old_lookups):
+            old_query(i)
+        per_call = (time.perf_counter() - start) / old_lookups
+        print(f"{'old query (raw phone, old indexes)':<42} {per_call * 1e6:>10.1f} us/check")
+        timed("indexed (phone_norm, vacancy, created_at)", indexed_query)
+        timed("RecentSubmissions (cache miss)", cached)
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark: applicant Excel export - peak RSS and wall time.
+
+Every measurement runs in a fresh child process so ru_maxrss is the peak of
+that export alone. "legacy" is the old fetchall() + regular Workbook path;
+it is skipped above --legacy-max rows because it needs several GB there.
+
+Usage: python benchmarks/bench_export.py [--rows 100000 1000000] [--legacy-max 100000]
+"""
+import argparse
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import db  # noqa: E402
+
+
+def fill(path: str, rows: int) -> None:
+    """Create the schema and insert `rows` applicants."""
+    db.DB_PATH = path
+    db.ensure_db()
+    db.close_pool()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO applicants (name, age, phone, phone_norm, vacancy, subject, experience, "
+        "workplace, username, photo_id, cv_file_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                f"Applicant {i}", "25", f"+99890{i:07d}", f"+99890{i:07d}", "Mentor",
+                "Dasturlash", "3 yil", "Geeks", f"user{i}",
+                "AgACAgIAAxkBAAIB" + "x" * 40, "BQACAgIAAxkBAAIC" + "y" * 40,
+            )
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_child(path: str, mode: str) -> None:
+    """Export in this (child) process and print elapsed seconds and peak RSS."""
+    db.DB_PATH = path
+    out = os.path.join(os.path.dirname(path), f"{mode}.xlsx")
+    start = time.perf_counter()
+    if mode == "legacy":
+        import openpyxl
+        with db.db_connection(readonly=True) as conn:
+            rows = conn.execute(f"SELECT {db.APPLICANT_EXPORT_COLUMNS} FROM applicants").fetchall()
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(db.APPLICANT_EXPORT_HEADERS)
+        for row in rows:
+            ws.append(list(row))
+        wb.save(out)
+    else:
+        db.write_xlsx(out, "Arizalar", db.APPLICANT_EXPORT_HEADERS, db.iter_applicants())
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed:.2f} {peak_kb}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--legacy-max", type=int, default=100_000)
+    parser.add_argument("--child", nargs=2, metavar=("DB", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'rows':>10} {'mode':>10} {'time, s':>10} {'peak RSS, MB':>14}")
+    for rows in args.rows:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "bench.db")
+        fill(path, rows)
+        modes = ["streaming"] + (["legacy"] if rows <= args.legacy_max else [])
+        for mode in modes:
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", path, mode],
+                check=True, capture_output=True, text=True, cwd=ROOT,
+            ).stdout.split()
+            elapsed, peak_kb = float(out[0]), int(out[1])
+            print(f"{rows:>10,} {mode:>10} {elapsed:>10.2f} {peak_kb / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
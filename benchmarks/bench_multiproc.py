@@ -0,0 +1,139 @@
+"""
+Benchmark: webhook throughput with 1, 2, 4... worker processes (multiproc.py).
+
+Runs the real front (multiproc.Supervisor, chat-id routing) and posts
+updates for many chats to it. The workers are webhook.QueuedRequestHandler
+apps whose only handler does WORK_MS of CPU work plus an FSM read and
+write, standing in for a form step; nothing is sent to Telegram. The
+time runs until every worker has handled every update, so the figure is
+end-to-end updates/s. Scaling needs free cores: on a machine with fewer
+cores than workers the numbers stay flat.
+
+Usage: python benchmarks/bench_multiproc.py [updates] [max_workers] [work_ms]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# config.py refuses to load without these; nothing here talks to Telegram
+for name, value in (("BOT_TOKEN", "123456:bench"), ("ADMIN_ID", "1"), ("GROUP_ID", "-1")):
+    os.environ.setdefault(name, value)
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != "--worker" else 4000
+MAX_WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+WORK_MS = float(os.getenv("BENCH_WORK_MS", sys.argv[3] if len(sys.argv) > 3 else "2"))
+CHATS = 1000
+CONCURRENCY = 64
+FRONT_PORT = 8290
+BASE_PORT = 8300
+PATH = "/webhook"
+
+
+def run_worker() -> None:
+    """Worker process: QueuedRequestHandler + a dispatcher with one CPU-bound handler."""
+    from aiogram import Bot, Dispatcher, Router
+    from aiogram.fsm.context import FSMContext
+    from aiogram.types import Message
+
+    from webhook import QueuedRequestHandler
+
+    router = Router()
+
+    @router.message()
+    async def step(message: Message, state: FSMContext):
+        data = await state.get_data()
+        deadline = time.perf_counter() + WORK_MS / 1000
+        while time.perf_counter() < deadline:
+            pass
+        await state.update_data(steps=data.get("steps", 0) + 1)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    # Unbounded for the benchmark: measure throughput, not 503s
+    handler = QueuedRequestHandler(dispatcher=dp, bot=Bot("123456:bench"), max_pending=10**9)
+    app = web.Application()
+    handler.register(app, path=PATH)
+
+    async def health(request: web.Request):
+        return web.json_response(handler.queue.stats())
+
+    app.router.add_get("/health", health)
+    web.run_app(app, host="127.0.0.1", port=int(os.environ["WEBAPP_PORT"]), print=None)
+
+
+def update(i: int) -> dict:
+    chat_id = 1000 + i % CHATS
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "text": "Javob",
+        },
+    }
+
+
+async def processed(session: aiohttp.ClientSession, supervisor) -> int:
+    total = 0
+    for worker in supervisor.workers:
+        async with session.get(worker.url("/health")) as resp:
+            total += (await resp.json())["processed"]
+    return total
+
+
+async def measure(workers: int) -> None:
+    from multiproc import Supervisor, create_front_app
+
+    supervisor = Supervisor(workers, BASE_PORT, [sys.executable, os.path.abspath(__file__), "--worker"], PATH)
+    runner = web.AppRunner(create_front_app(supervisor))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", FRONT_PORT).start()
+    try:
+        while not all(worker.ready for worker in supervisor.workers):
+            await asyncio.sleep(0.1)
+        async with aiohttp.ClientSession() as session:
+            pending = iter(range(UPDATES))
+            acks = []
+
+            async def client() -> None:
+                for i in pending:
+                    sent = time.perf_counter()
+                    async with session.post(f"http://127.0.0.1:{FRONT_PORT}{PATH}", json=update(i)) as resp:
+                        assert resp.status == 200, resp.status
+                    acks.append(time.perf_counter() - sent)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+            while await processed(session, supervisor) < UPDATES:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+        acks.sort()
+        print(
+            f"{workers} worker(s): {UPDATES / elapsed:>8.0f} updates/s   "
+            f"ack p50 {acks[len(acks) // 2] * 1000:6.1f} ms  p99 {acks[int(len(acks) * 0.99)] * 1000:6.1f} ms"
+        )
+    finally:
+        await runner.cleanup()
+
+
+async def main() -> None:
+    os.environ["BENCH_WORK_MS"] = str(WORK_MS)  # for the workers
+    print(f"{UPDATES:,} updates from {CHATS} chats, {WORK_MS} ms CPU per update, {os.cpu_count()} CPU(s)")
+    workers = 1
+    while workers <= MAX_WORKERS:
+        await measure(workers)
+        workers *= 2
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        run_worker()
+    else:
+        asyncio.run(main())
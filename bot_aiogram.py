@@ -5,9 +5,10 @@ Run this file with: python bot_aiogram.py
 
 import asyncio
 import logging
+import signal
 from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiogram.client.default import DefaultBotProperties
 
 from config import (
@@ -17,8 +18,21 @@ from config import (
     WEBAPP_HOST,
     WEBAPP_PORT,
     WEBHOOK_SECRET,
+    GROUP_ID,
+    SUPPORT_GROUP_ID,
+    RATE_LIMIT_GLOBAL_PER_SEC,
+    BROADCAST_RATE_PER_SEC,
+    WORKERS,
+    WORKER_INDEX,
 )
-from db import ensure_db
+from db import ensure_db, shutdown_executor, close_pool, write_queue
+import exports
+from fsm_storage import SQLiteStorage
+from rate_limiter import RateLimiter
+from outbox import outbox_worker, OUTBOX_IDLE_POLL
+from broadcast import broadcaster, BROADCAST_GLOBAL_SHARE
+from webhook import QueuedRequestHandler
+from ingress import UpdateFilter
 
 # Import routers
 from handlers.admin import router as admin_router
@@ -38,7 +52,22 @@ logger = logging.getLogger("geeks_bot")
 # ==========================
 
 bot = Bot(TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
+# Every outgoing call waits for its turn under Telegram's global and per-chat limits.
+# As one of multiproc.py's workers this process gets an even share of the global limit.
+GLOBAL_RATE_SHARE = RATE_LIMIT_GLOBAL_PER_SEC / (WORKERS if WORKER_INDEX is not None else 1)
+rate_limiter = RateLimiter(global_per_sec=GLOBAL_RATE_SHARE)
+# Broadcasts take part of this process's share, never all of it: the rest
+# is left to replies and notifications queued behind them in the limiter
+broadcaster.rate = min(BROADCAST_RATE_PER_SEC, GLOBAL_RATE_SHARE * BROADCAST_GLOBAL_SHARE)
+# Jobs that must run once per bot (outbox, broadcasts, FSM purge, webhook
+# registration): here when running alone, in worker 0 under multiproc.py
+RUNS_SINGLETON_JOBS = WORKER_INDEX in (None, 0)
+bot.session.middleware(rate_limiter)
+# FSM state lives in hr_bot.db, so half-filled forms survive restarts.
+# Dispatcher shutdown (registered by setup_application, which runs before
+# our on_shutdown) closes the storage and flushes pending changes.
+fsm_storage = SQLiteStorage()
+dp = Dispatcher(storage=fsm_storage)
 
 # Register routers in priority order
 # Admin first (highest priority), then HR, Courses, Support, Common last (FAQ fallback)
@@ -48,6 +77,9 @@ dp.include_router(courses_router)
 dp.include_router(support_router)
 dp.include_router(common_router)  # FAQ and general handlers last
 
+# Update types some handler listens to: what Telegram is asked to send
+ALLOWED_UPDATES = dp.resolve_used_update_types()
+
 # ==========================
 #   WEBHOOK SERVER (aiohttp)
 # ==========================
@@ -56,28 +88,57 @@ dp.include_router(common_router)  # FAQ and general handlers last
 async def on_startup(app: web.Application):
     """Initialize database and set webhook on startup."""
     ensure_db()
+    if not RUNS_SINGLETON_JOBS:
+        logger.info(f"Worker {WORKER_INDEX} started")
+        return
+    purged = await fsm_storage.purge_expired()
+    if purged:
+        logger.info(f"Purged {purged} expired FSM records")
+    # Other workers queue outbox rows too and cannot wake() this process: poll often
+    await outbox_worker.start(bot, idle_poll=1.0 if WORKER_INDEX is not None else OUTBOX_IDLE_POLL)
+    await broadcaster.resume(bot)
     await bot.set_webhook(
         WEBHOOK_URL,
         secret_token=WEBHOOK_SECRET,
-        allowed_updates=["message", "callback_query", "edited_message", "channel_post"],
+        allowed_updates=ALLOWED_UPDATES,
     )
     logger.info(f"Webhook set to {WEBHOOK_URL}")
 
 
 async def on_shutdown(app: web.Application):
-    """Cleanup on shutdown."""
-    await bot.delete_webhook()
-    logger.info("Webhook deleted")
+    """
+    Cleanup on shutdown. By now the server no longer accepts requests, the
+    webhook queue is drained and the FSM storage is flushed (hooks
+    registered before this one); the bot session is closed at cleanup.
+
+    The webhook stays registered: updates arriving while the bot restarts
+    wait at Telegram and are delivered to the new process.
+    """
+    await broadcaster.stop()
+    await outbox_worker.stop()
+    await exports.shutdown()
+    # Flushes writes still queued (outbox results, broadcast checkpoints)
+    await write_queue.close()
+    shutdown_executor()
+    close_pool()
 
 
 def create_app() -> web.Application:
     """Create aiohttp application with webhook handler."""
     app = web.Application()
-    
+    # Answers Telegram as soon as the update is queued; workers handle it after
+    # Staff group chatter would otherwise reach the FAQ fallback: only commands get through
+    webhook_handler = QueuedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        update_filter=UpdateFilter(ALLOWED_UPDATES, (GROUP_ID, SUPPORT_GROUP_ID)),
+    )
+
     try:
-        SimpleRequestHandler(
-            dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET
-        ).register(app, path=WEBHOOK_PATH)
+        # Order matters at shutdown: drain the queue, then dispatcher shutdown
+        # (FSM storage flush), then on_shutdown below
+        webhook_handler.register(app, path=WEBHOOK_PATH)
         setup_application(app, dp, bot=bot)
     except Exception as e:
         logger.exception(f"Error setting up webhook handler: {e}")
@@ -88,7 +149,18 @@ def create_app() -> web.Application:
 
     # Optional health endpoint
     async def health(request: web.Request):
-        return web.json_response({"status": "ok"})
+        return web.json_response(
+            {
+                "status": "ok",
+                "webhook": webhook_handler.queue.stats(),
+                "dedup": webhook_handler.dedup.stats(),
+                "filtered": webhook_handler.update_filter.stats(),
+                "fsm_storage": fsm_storage.stats(),
+                "rate_limiter": rate_limiter.stats(),
+                "outbox": outbox_worker.stats(),
+                "broadcast": broadcaster.stats(),
+            }
+        )
 
     app.router.add_get("/", health)
     app.router.add_get("/health", health)
@@ -109,9 +181,15 @@ async def main():
         logger.info(f"Starting webhook server on {WEBAPP_HOST}:{WEBAPP_PORT}")
         await site.start()
 
-        # Keep running
-        while True:
-            await asyncio.sleep(3600)
+        # Run until SIGTERM (multiproc.py restarting this worker, service stop) or Ctrl+C,
+        # then shut down cleanly so queued updates and FSM changes are not lost
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        logger.info("Stopping webhook server")
+        await runner.cleanup()
     except Exception as e:
         logger.exception(f"Fatal error in main: {e}")
         raise
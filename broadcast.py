@@ -0,0 +1,190 @@
+"""
+Announcements to everyone who has used the bot (admin /broadcast).
+
+Recipients (applicants, support ticket authors and course leads) are read
+page by page in user_id order and sent at BROADCAST_RATE_PER_SEC, capped
+at BROADCAST_GLOBAL_SHARE of the process's share of Telegram's ~30 msg/s
+bot-wide limit, so normal traffic keeps the rest (every call also goes
+through rate_limiter.RateLimiter). After each page the last
+user_id and the counters are saved to the broadcasts table, so a broadcast
+interrupted by a restart resumes where it stopped; at most one page is sent
+twice.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import Message
+
+import db
+from config import BROADCAST_RATE_PER_SEC
+
+logger = logging.getLogger(__name__)
+
+# Recipients read (and checkpointed) at a time
+BROADCAST_PAGE_SIZE = 100
+# Part of the process's global rate limit a broadcast may use (see bot_aiogram)
+BROADCAST_GLOBAL_SHARE = 2 / 3
+# Sends in flight at once (the rate is still Broadcaster.rate)
+BROADCAST_CONCURRENCY = 10
+# Seconds between progress updates of the admin's status message
+PROGRESS_INTERVAL = 5.0
+# Errors meaning the recipient cannot receive messages from the bot any more
+BLOCKED_MARKERS = ("chat not found", "user is deactivated", "bot was blocked", "bot can't initiate")
+
+
+class Broadcaster:
+    """Runs at most one broadcast at a time as a background task."""
+
+    def __init__(self, rate: float = BROADCAST_RATE_PER_SEC):
+        self.rate = rate
+        self._task: asyncio.Task | None = None
+        self._starting = False
+        self._stopping = False
+        self._cancelled = False
+        self.broadcast_id: int | None = None
+        self.counts: Dict[str, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._starting or (self._task is not None and not self._task.done())
+
+    def stats(self) -> Dict[str, Any]:
+        """Current broadcast progress (for the health endpoint)."""
+        return {"running": self.running, "id": self.broadcast_id, **self.counts}
+
+    async def start(self, bot: Bot, text: str, created_by: int, status_message: Message) -> int:
+        """Create a broadcast and start sending it; returns the broadcast id."""
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        self._starting = True
+        try:
+            total = await db.count_broadcast_recipients_async()
+            broadcast_id = await db.create_broadcast_async(
+                text, created_by, total, status_message.chat.id, status_message.message_id
+            )
+            self._launch(bot, (broadcast_id, text, total, 0, 0, 0, 0, status_message.chat.id,
+                               status_message.message_id))
+        finally:
+            self._starting = False
+        return broadcast_id
+
+    async def resume(self, bot: Bot) -> None:
+        """Continue a broadcast left running by the previous process (called at startup)."""
+        row = await db.get_running_broadcast_async()
+        if row and not self.running:
+            logger.info(f"Resuming broadcast #{row[0]} after user_id {row[3]}")
+            self._launch(bot, row)
+
+    def cancel(self) -> bool:
+        """Stop the running broadcast for good (admin /broadcast_stop)."""
+        if not self.running:
+            return False
+        self._cancelled = True
+        return True
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Shutdown: finish the current page and leave the broadcast to be resumed."""
+        if self._task is None or self._task.done():
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Broadcast: stop timed out; the current page will be resent on resume")
+        self._task = None
+
+    def _launch(self, bot: Bot, row: Tuple) -> None:
+        self._stopping = self._cancelled = False
+        self._task = asyncio.get_running_loop().create_task(self._run(bot, *row), name="broadcast")
+
+    async def _run(
+        self, bot: Bot, broadcast_id: int, text: str, total: int, last_user_id: int,
+        delivered: int, blocked: int, failed: int, status_chat_id: int | None, status_message_id: int | None,
+    ) -> None:
+        counts = {"delivered": delivered, "blocked": blocked, "failed": failed}
+        self.broadcast_id, self.counts = broadcast_id, counts
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+        interval = 1.0 / self.rate
+        started = time.monotonic()
+        sent_now = 0
+        next_slot = started
+        last_report = 0.0
+
+        async def report(title: str) -> None:
+            if not status_chat_id:
+                return
+            done = sum(counts.values())
+            elapsed = max(time.monotonic() - started, 1e-6)
+            text_ = (
+                f"{title}\n\n"
+                f"📨 {done}/{total} ({done * 100 // max(total, 1)}%)\n"
+                f"✅ Yetkazildi: {counts['delivered']}\n"
+                f"🚫 Bloklagan: {counts['blocked']}\n"
+                f"❌ Xato: {counts['failed']}\n"
+                f"⚡ {sent_now / elapsed:.1f} xabar/s"
+            )
+            try:
+                await bot.edit_message_text(text_, chat_id=status_chat_id, message_id=status_message_id)
+            except Exception as e:
+                logger.debug(f"Broadcast progress update failed: {e}")
+
+        async def send_one(user_id: int) -> None:
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                counts["delivered"] += 1
+            except TelegramForbiddenError:
+                counts["blocked"] += 1
+            except TelegramBadRequest as e:
+                if any(marker in str(e).lower() for marker in BLOCKED_MARKERS):
+                    counts["blocked"] += 1
+                else:
+                    counts["failed"] += 1
+                    logger.warning(f"Broadcast #{broadcast_id} to {user_id} failed: {e}")
+            except Exception as e:
+                counts["failed"] += 1
+                logger.warning(f"Broadcast #{broadcast_id} to {user_id} failed: {e}")
+            finally:
+                semaphore.release()
+
+        try:
+            while not (self._stopping or self._cancelled):
+                page = await db.get_broadcast_recipients_async(last_user_id, BROADCAST_PAGE_SIZE)
+                if not page:
+                    break
+                tasks = []
+                for user_id in page:
+                    now = time.monotonic()
+                    if next_slot > now:
+                        await asyncio.sleep(next_slot - now)
+                    next_slot = max(next_slot, now) + interval
+                    await semaphore.acquire()
+                    tasks.append(asyncio.create_task(send_one(user_id)))
+                    sent_now += 1
+                await asyncio.gather(*tasks)
+                last_user_id = page[-1]
+                await db.checkpoint_broadcast_async(broadcast_id, last_user_id, **counts)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await report(f"📣 Broadcast #{broadcast_id} davom etmoqda...")
+        except Exception as e:
+            # Left 'running': resumed from the last checkpoint on next start
+            logger.exception(f"Broadcast #{broadcast_id} stopped by an error: {e}")
+            return
+
+        if self._stopping:
+            logger.info(f"Broadcast #{broadcast_id} paused at user_id {last_user_id}")
+            return
+        status = "cancelled" if self._cancelled else "done"
+        await db.checkpoint_broadcast_async(broadcast_id, last_user_id, status=status, **counts)
+        logger.info(f"Broadcast #{broadcast_id} {status}: {counts}")
+        await report(
+            f"✅ Broadcast #{broadcast_id} tugadi" if status == "done"
+            else f"⏹ Broadcast #{broadcast_id} to'xtatildi"
+        )
+
+
+broadcaster = Broadcaster()
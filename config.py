@@ -45,12 +45,26 @@ SUPPORT_GROUP_ID: int = int(os.getenv("SUPPORT_GROUP_ID", "0"))
 
 # Application Settings
 SESSION_TIMEOUT: int = int(os.getenv("SESSION_TIMEOUT", "3600"))  # 1 hour
+FSM_FLUSH_INTERVAL: float = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))  # seconds between FSM storage writes
+FSM_MAX_ENTRIES: int = int(os.getenv("FSM_MAX_ENTRIES", "10000"))  # FSM keys kept in memory (LRU)
+SEND_WORKERS: int = int(os.getenv("SEND_WORKERS", "4"))  # app.py sender threads (chats are sharded across them)
+SEND_QUEUE_SIZE: int = int(os.getenv("SEND_QUEUE_SIZE", "1000"))  # app.py queued sends before new ones are dropped
 WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "https://hrbot.geeksandijan.uz")
 # WEBHOOK_PATH: .env dan olsa ishlatiladi, aks holda TOKEN dan yaratiladi
 WEBHOOK_PATH_ENV: str = os.getenv("WEBHOOK_PATH", "")
 WEBHOOK_PATH: str = WEBHOOK_PATH_ENV if WEBHOOK_PATH_ENV else (f"/{TOKEN}" if TOKEN else "/")
 WEBHOOK_URL: str = WEBHOOK_HOST + WEBHOOK_PATH
 WEBHOOK_SECRET: Optional[str] = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "8"))  # aiogram updates handled concurrently
+WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # queued updates before answering 503
+WEBHOOK_DRAIN_TIMEOUT: float = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))  # seconds to finish queued updates at shutdown
+
+# Outgoing Bot API rate limits (see rate_limiter.RateLimiter)
+RATE_LIMIT_GLOBAL_PER_SEC: float = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SEC", "30"))  # all chats together
+RATE_LIMIT_GROUP_PER_MIN: float = float(os.getenv("RATE_LIMIT_GROUP_PER_MIN", "20"))  # one group/channel
+RATE_LIMIT_PRIVATE_PER_SEC: float = float(os.getenv("RATE_LIMIT_PRIVATE_PER_SEC", "1"))  # one private chat
+RATE_LIMIT_MAX_RETRIES: int = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))  # 429 retries per call
+BROADCAST_RATE_PER_SEC: float = float(os.getenv("BROADCAST_RATE_PER_SEC", "20"))  # /broadcast, below the global limit
 
 # Timezone configuration (default: UTC+5 for Uzbekistan)
 TIMEZONE_OFFSET: int = int(os.getenv("TIMEZONE_OFFSET", "5"))  # UTC+5
@@ -58,6 +72,12 @@ TIMEZONE_OFFSET: int = int(os.getenv("TIMEZONE_OFFSET", "5"))  # UTC+5
 WEBAPP_HOST: str = os.getenv("WEBAPP_HOST", "0.0.0.0")  # aiogram server host
 WEBAPP_PORT: int = int(os.getenv("WEBAPP_PORT", "8004"))  # aiogram server port
 
+# Multi-process mode (python multiproc.py): a front on WEBAPP_PORT routes updates to worker processes
+WORKERS: int = int(os.getenv("WORKERS", "2"))  # aiogram worker processes
+WORKER_BASE_PORT: int = int(os.getenv("WORKER_BASE_PORT", "8100"))  # worker i listens on 127.0.0.1:port+i
+# Set by multiproc.py in each worker process; None when bot_aiogram.py runs alone
+WORKER_INDEX: Optional[int] = int(os.environ["BOT_WORKER_INDEX"]) if os.getenv("BOT_WORKER_INDEX") else None
+
 # Validate required configuration
 if not TOKEN:
     raise ValueError("BOT_TOKEN must be set in .env file")
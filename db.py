@@ -1,161 +1,593 @@
 """
 Database utilities for HR Bot (SQLite + context manager)
 """
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import List, Tuple, Dict, Any
+from functools import partial
+from typing import List, Tuple, Dict, Any, Callable, Iterator, NamedTuple, TypeVar
 
 
 DB_PATH = "hr_bot.db"
 
+# Connection pool tuning (see ConnectionPool)
+DB_READERS = 4  # max concurrent read connections
+DB_BUSY_TIMEOUT = 10  # seconds to wait for a lock before "database is locked"
+DB_MMAP_SIZE = 64 * 1024 * 1024  # bytes of the DB file mapped into memory
+DB_CACHE_SIZE_KB = 8 * 1024  # page cache per connection
+DB_CHECKPOINT_EVERY = 500  # write transactions between passive WAL checkpoints
 
-@contextmanager
-def db_connection():
+# Size of the dedicated thread pool used by the async API below.
+# One thread for the writer plus one per reader connection, so exports and
+# admin listings can run while user submissions are being written.
+DB_EXECUTOR_WORKERS = DB_READERS + 1
+
+# Columns of an applicant export row, in the order of the Excel headers
+APPLICANT_EXPORT_COLUMNS = (
+    "id, name, age, phone, vacancy, subject, experience, workplace, "
+    "username, photo_id, cv_file_id, created_at"
+)
+
+# Rows fetched per round trip while streaming an export
+EXPORT_CHUNK_SIZE = 1000
+
+# Same phone + vacancy within this many seconds is rejected as a duplicate
+DUPLICATE_WINDOW = 24 * 3600
+
+# Group commit for submissions (see WriteQueue)
+WRITE_BATCH_MAX_ROWS = 100  # flush as soon as this many inserts are pending
+WRITE_BATCH_MAX_DELAY = 0.005  # ...or after this many seconds
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
     """
-    Database connection context manager.
-    Ensures proper connection handling and cleanup.
+    Long-lived SQLite connections: one writer plus up to `readers` readers.
+
+    The database runs in WAL mode, so readers never block the writer and
+    the writer never blocks readers. Writes are serialized by a lock and run
+    inside BEGIN IMMEDIATE ... COMMIT, so a writer waits for the lock once
+    up front instead of failing half way through a transaction.
     """
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=10)
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.pid = os.getpid()
+        self._writer: sqlite3.Connection | None = None
+        self._writer_lock = threading.Lock()
+        self._idle_readers: queue.LifoQueue = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(readers)
+        self._writes_since_checkpoint = 0
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """Open a connection and apply the pragmas once, at creation time."""
+        # isolation_level=None: transactions are managed explicitly below
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
         conn.row_factory = sqlite3.Row  # Enable column access by name
-        yield conn
-        conn.commit()
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        raise
-    finally:
-        if conn:
-            conn.close()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
 
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Yield the writer connection inside a transaction (commit on success)."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            self._writes_since_checkpoint += 1
+            if self._writes_since_checkpoint >= DB_CHECKPOINT_EVERY:
+                self._checkpoint(conn, "PASSIVE")
 
-def ensure_db() -> None:
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Yield an idle read-only connection, opening one if none is free."""
+        with self._reader_slots:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect(readonly=True)
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                self._idle_readers.put(conn)
+
+    def _checkpoint(self, conn: sqlite3.Connection, mode: str) -> None:
+        """Copy WAL frames back into the main DB file."""
+        try:
+            conn.execute(f"PRAGMA wal_checkpoint({mode})")
+            self._writes_since_checkpoint = 0
+        except sqlite3.Error as e:
+            logger.warning(f"WAL checkpoint failed: {e}")
+
+    def checkpoint(self, mode: str = "PASSIVE") -> None:
+        """Run a WAL checkpoint on the writer connection."""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._checkpoint(self._writer, mode)
+
+    def close(self) -> None:
+        """Checkpoint and close every connection owned by this pool."""
+        self.checkpoint("TRUNCATE")
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
     """
-    Create database table if it doesn't exist.
-    Add missing columns if needed for backward compatibility.
+    Return the process-wide connection pool.
+    A forked child (Passenger, process pools) gets its own pool: SQLite
+    connections must never be shared across processes.
     """
-    try:
-        with db_connection() as conn:
-            c = conn.cursor()
-            # Create table if not exists
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+
+def close_pool() -> None:
+    """Close the connection pool (used on shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+def normalize_phone(phone: str | None) -> str | None:
+    """
+    Normalize a phone number to E.164, e.g. "+998 90 123-45-67" -> "+998901234567".
+    Local 9-digit Uzbek numbers get the +998 prefix. Returns None if it is not a phone.
+    """
+    if not phone:
+        return None
+    phone = phone.strip()
+    digits = re.sub(r"\D", "", phone)
+    if phone.startswith("00"):  # 00 international prefix
+        digits = digits[2:]
+    if len(digits) == 9:
+        digits = "998" + digits
+    if not 7 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return "+" + digits
+
+
+class RecentSubmissions:
+    """
+    In-memory set of (phone_norm, vacancy) pairs submitted in the last
+    DUPLICATE_WINDOW seconds, so the common non-duplicate case of the
+    duplicate check never runs a query.
+
+    PRAGMA data_version on the writer connection only changes when ANOTHER
+    connection (the legacy Flask app, another process) commits. While it is
+    unchanged, this process has seen every application and a cache miss is
+    authoritative. Otherwise only the applicants added since the last seen
+    id are read (a rowid range, usually empty: most of those commits are
+    FSM flushes, outbox and broadcast writes); applications are never
+    updated or deleted, so that is all that can have changed. The whole
+    window is scanned only on first use and after invalidate().
+    Only touched while holding the writer connection, so no extra locking.
+    """
+
+    def __init__(self, window: int = DUPLICATE_WINDOW):
+        self.window = window
+        self._seen: Dict[Tuple[str, str], float] = {}
+        self._order: deque = deque()  # (submitted_at, key), oldest first
+        self._data_version: int | None = None
+        self._last_id: int | None = None  # highest applicants.id loaded or added
+
+    def invalidate(self) -> None:
+        """Force a full reload on next use (e.g. after a rolled back write)."""
+        self._data_version = None
+        self._last_id = None
+
+    def _sync(self, c: sqlite3.Cursor) -> None:
+        version = c.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        if self._last_id is None:
+            self._last_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM applicants").fetchone()[0]
+            self._seen.clear()
+            self._order.clear()
             c.execute(
                 """
-                CREATE TABLE IF NOT EXISTS applicants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    age TEXT,
-                    phone TEXT,
-                    vacancy TEXT NOT NULL,
-                    subject TEXT,
-                    experience TEXT,
-                    workplace TEXT,
-                    username TEXT,
-                    photo_id TEXT,
-                    cv_file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
+                SELECT id, phone_norm, vacancy, CAST(strftime('%s', created_at) AS INTEGER)
+                FROM applicants
+                WHERE created_at > datetime('now', ?) AND phone_norm IS NOT NULL
+                ORDER BY created_at
+            """,
+                (f"-{self.window} seconds",),
             )
-            
-            # Check and add missing columns
-            c.execute("PRAGMA table_info(applicants)")
-            existing_cols = {row[1] for row in c.fetchall()}
-            
-            needed_cols = {
-                "name": "TEXT",
-                "age": "TEXT",
-                "phone": "TEXT",
-                "vacancy": "TEXT",
-                "subject": "TEXT",
-                "experience": "TEXT",
-                "workplace": "TEXT",
-                "username": "TEXT",
-                "photo_id": "TEXT",
-                "cv_file_id": "TEXT",
-                "created_at": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
-            }
-            
-            for col, coltype in needed_cols.items():
-                if col not in existing_cols:
-                    try:
-                        if col == "created_at":
-                            c.execute(f"ALTER TABLE applicants ADD COLUMN {col} {coltype}")
-                        else:
-                            c.execute(f"ALTER TABLE applicants ADD COLUMN {col} TEXT")
-                    except Exception as e:
-                        import logging
-                        logger = logging.getLogger(__name__)
-                        logger.exception(f"Cannot add column {col}: {e}")
-            
-            # Create support_tickets table
+        else:
             c.execute(
                 """
-                CREATE TABLE IF NOT EXISTS support_tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    username TEXT,
-                    phone TEXT,
-                    category TEXT NOT NULL,
-                    question TEXT,
-                    question_voice_id TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    answered_at TIMESTAMP,
-                    answered_by INTEGER,
-                    answer_text TEXT
-                )
-            """
+                SELECT id, phone_norm, vacancy, CAST(strftime('%s', created_at) AS INTEGER)
+                FROM applicants
+                WHERE id > ? AND phone_norm IS NOT NULL
+                ORDER BY id
+            """,
+                (self._last_id,),
             )
-            
-            # Check and add phone column if missing (for existing tables)
-            c.execute("PRAGMA table_info(support_tickets)")
-            existing_cols = {row[1] for row in c.fetchall()}
-            if "phone" not in existing_cols:
-                try:
-                    c.execute("ALTER TABLE support_tickets ADD COLUMN phone TEXT")
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.exception(f"Cannot add column phone to support_tickets: {e}")
-            
-            # Create course_leads table
+        for row_id, phone_norm, vacancy, submitted_at in c.fetchall():
+            self._remember((phone_norm, vacancy), float(submitted_at))
+            self._last_id = max(self._last_id, row_id)
+        self._data_version = version
+
+    def _remember(self, key: Tuple[str, str], submitted_at: float) -> None:
+        self._seen[key] = submitted_at
+        self._order.append((submitted_at, key))
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._order and self._order[0][0] <= cutoff:
+            submitted_at, key = self._order.popleft()
+            if self._seen.get(key) == submitted_at:
+                del self._seen[key]
+
+    def contains(self, c: sqlite3.Cursor, phone_norm: str, vacancy: str) -> bool:
+        """True if the pair was submitted within the window."""
+        self._sync(c)
+        self._prune(time.time())
+        return (phone_norm, vacancy) in self._seen
+
+    def add(self, phone_norm: str, vacancy: str, row_id: int) -> None:
+        """Record a submission written by this process (after contains() synced the cache)."""
+        self._remember((phone_norm, vacancy), time.time())
+        if self._last_id is not None:
+            self._last_id = max(self._last_id, row_id)
+
+
+recent_applications = RecentSubmissions()
+
+
+@contextmanager
+def db_connection(readonly: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Database connection context manager backed by the connection pool.
+    Writes commit when the block exits and roll back on error;
+    readonly=True borrows a reader connection instead of the writer.
+    """
+    pool = get_pool()
+    if readonly:
+        with pool.reader() as conn:
+            yield conn
+        return
+    try:
+        with pool.writer() as conn:
+            yield conn
+    except BaseException:
+        # Applications remembered during this transaction did not land
+        recent_applications.invalidate()
+        raise
+
+
+# ==========================
+#   SCHEMA MIGRATIONS
+# ==========================
+# Each migration runs once, in order, inside its own write transaction.
+# The number of applied migrations is stored in PRAGMA user_version, so a
+# database that is already current costs a single PRAGMA read at startup.
+# Never edit a migration that has shipped - append a new one instead.
+
+
+def _migration_001_base_schema(c: sqlite3.Cursor) -> None:
+    """Base tables and indexes (also upgrades databases created before versioning)."""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS applicants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age TEXT,
+            phone TEXT,
+            vacancy TEXT NOT NULL,
+            subject TEXT,
+            experience TEXT,
+            workplace TEXT,
+            username TEXT,
+            photo_id TEXT,
+            cv_file_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+
+    # Old databases may miss some columns
+    c.execute("PRAGMA table_info(applicants)")
+    existing_cols = {row[1] for row in c.fetchall()}
+    needed_cols = {
+        "name": "TEXT",
+        "age": "TEXT",
+        "phone": "TEXT",
+        "vacancy": "TEXT",
+        "subject": "TEXT",
+        "experience": "TEXT",
+        "workplace": "TEXT",
+        "username": "TEXT",
+        "photo_id": "TEXT",
+        "cv_file_id": "TEXT",
+        # ADD COLUMN rejects a non-constant default: backfilled below, and
+        # _insert_application sets it explicitly
+        "created_at": "TIMESTAMP",
+    }
+    for col, coltype in needed_cols.items():
+        if col not in existing_cols:
+            logger.info(f"Adding missing column `{col}` to applicants")
+            c.execute(f"ALTER TABLE applicants ADD COLUMN {col} {coltype}")
+    if "created_at" not in existing_cols:
+        c.execute("UPDATE applicants SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS support_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            phone TEXT,
+            category TEXT NOT NULL,
+            question TEXT,
+            question_voice_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            answered_at TIMESTAMP,
+            answered_by INTEGER,
+            answer_text TEXT
+        )
+    """
+    )
+    c.execute("PRAGMA table_info(support_tickets)")
+    if "phone" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE support_tickets ADD COLUMN phone TEXT")
+
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS course_leads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            course_name TEXT NOT NULL,
+            tariff TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+
+    for index_sql in (
+        "CREATE INDEX IF NOT EXISTS idx_applicants_vacancy ON applicants(vacancy)",
+        "CREATE INDEX IF NOT EXISTS idx_applicants_created_at ON applicants(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_support_tickets_category ON support_tickets(category)",
+        "CREATE INDEX IF NOT EXISTS idx_support_tickets_user_id ON support_tickets(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_support_tickets_created_at ON support_tickets(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_course_leads_course_name ON course_leads(course_name)",
+        "CREATE INDEX IF NOT EXISTS idx_course_leads_created_at ON course_leads(created_at)",
+    ):
+        c.execute(index_sql)
+
+
+def _migration_002_applicants_phone_norm(c: sqlite3.Cursor) -> None:
+    """Normalized phone column + composite index for the 24h duplicate check."""
+    c.execute("PRAGMA table_info(applicants)")
+    if "phone_norm" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE applicants ADD COLUMN phone_norm TEXT")
+    c.connection.create_function("normalize_phone", 1, normalize_phone, deterministic=True)
+    c.execute("UPDATE applicants SET phone_norm = normalize_phone(phone) WHERE phone IS NOT NULL")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_applicants_phone_norm_vacancy_created_at "
+        "ON applicants(phone_norm, vacancy, created_at)"
+    )
+
+
+def _migration_003_data_versions(c: sqlite3.Cursor) -> None:
+    """Per-table change counters, bumped by triggers on every INSERT/UPDATE/DELETE."""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    for table in ("applicants", "support_tickets"):
+        c.execute("INSERT OR IGNORE INTO data_versions (table_name, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
             c.execute(
-                """
-                CREATE TABLE IF NOT EXISTS course_leads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    username TEXT,
-                    course_name TEXT NOT NULL,
-                    tariff TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
             """
             )
-            
-            # Create indexes for better performance
-            indexes = [
-                "CREATE INDEX IF NOT EXISTS idx_applicants_vacancy ON applicants(vacancy)",
-                "CREATE INDEX IF NOT EXISTS idx_applicants_created_at ON applicants(created_at)",
-                "CREATE INDEX IF NOT EXISTS idx_support_tickets_category ON support_tickets(category)",
-                "CREATE INDEX IF NOT EXISTS idx_support_tickets_user_id ON support_tickets(user_id)",
-                "CREATE INDEX IF NOT EXISTS idx_support_tickets_created_at ON support_tickets(created_at)",
-                "CREATE INDEX IF NOT EXISTS idx_course_leads_course_name ON course_leads(course_name)",
-                "CREATE INDEX IF NOT EXISTS idx_course_leads_created_at ON course_leads(created_at)",
-            ]
-            for index_sql in indexes:
-                try:
-                    c.execute(index_sql)
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"Could not create index: {e}")
-            
-            conn.commit()
+
+
+def _migration_004_fsm_storage(c: sqlite3.Cursor) -> None:
+    """Persistent aiogram FSM state and data (see fsm_storage.SQLiteStorage)."""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        )
+    """
+    )
+
+
+def _migration_005_outbox(c: sqlite3.Cursor) -> None:
+    """Staff notifications, one row per recipient chat (see outbox.OutboxWorker)."""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedup_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            steps TEXT NOT NULL,
+            steps_done INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt_at ON outbox(status, next_attempt_at)"
+    )
+
+
+def _migration_006_broadcasts(c: sqlite3.Cursor) -> None:
+    """applicants.user_id plus user_id indexes for broadcast recipients; broadcast checkpoints."""
+    c.execute("PRAGMA table_info(applicants)")
+    if "user_id" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE applicants ADD COLUMN user_id INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_applicants_user_id ON applicants(user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_course_leads_user_id ON course_leads(user_id)")
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)")
+
+
+def _migration_007_processed_updates(c: sqlite3.Cursor) -> None:
+    """Webhook update_ids already accepted by app.py, across its processes and restarts (see ingress.UpdateDeduplicator)."""
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            received_at REAL NOT NULL
+        )
+    """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at)")
+
+
+def _migration_008_outbox_claimed_at(c: sqlite3.Cursor) -> None:
+    """outbox.claimed_at: when a row went 'sending', so a row stuck there can be claimed again."""
+    c.execute("PRAGMA table_info(outbox)")
+    if "claimed_at" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE outbox ADD COLUMN claimed_at REAL")
+
+
+# Ordered list of migrations; user_version == number of applied entries
+MIGRATIONS: List[Callable[[sqlite3.Cursor], None]] = [
+    _migration_001_base_schema,
+    _migration_002_applicants_phone_norm,
+    _migration_003_data_versions,
+    _migration_004_fsm_storage,
+    _migration_005_outbox,
+    _migration_006_broadcasts,
+    _migration_007_processed_updates,
+    _migration_008_outbox_claimed_at,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_data_version(table: str) -> int:
+    """Change counter of a table; differs whenever any row was added, changed or removed."""
+    with db_connection(readonly=True) as conn:
+        row = conn.execute("SELECT version FROM data_versions WHERE table_name = ?", (table,)).fetchone()
+        return row[0] if row else 0
+
+
+def get_schema_version() -> int:
+    """Return the schema version stored in the database file."""
+    with db_connection(readonly=True) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def ensure_db() -> None:
+    """
+    Apply pending schema migrations.
+    Returns after one PRAGMA read when the database is already current.
+    """
+    try:
+        if get_schema_version() >= SCHEMA_VERSION:
+            return
+
+        while True:
+            with db_connection() as conn:
+                # Re-read under the write lock: another process may have migrated meanwhile
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= SCHEMA_VERSION:
+                    break
+                migration = MIGRATIONS[version]
+                logger.info(f"Applying migration {version + 1}: {migration.__name__}")
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+        logger.info(f"Database schema is at version {SCHEMA_VERSION}")
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.exception(f"Error initializing database: {e}")
         raise
 
@@ -172,53 +604,58 @@ def save_application(data: Dict[str, Any]) -> int:
         Inserted row ID, or raises ValueError if duplicate found
     """
     with db_connection() as conn:
-        c = conn.cursor()
-        
-        # Check for duplicate: same phone + vacancy within last 24 hours
-        phone = data.get("phone")
-        vacancy = data.get("vacancy")
-        if phone and vacancy:
-            c.execute(
-                """
-                SELECT id, created_at FROM applicants
-                WHERE phone = ? AND vacancy = ?
-                AND created_at > datetime('now', '-24 hours')
-                ORDER BY created_at DESC
-                LIMIT 1
-            """,
-                (phone, vacancy),
-            )
-            duplicate = c.fetchone()
-            if duplicate:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Duplicate application detected: phone={phone}, vacancy={vacancy}")
-                raise ValueError(
-                    "Siz bu vakansiya bo'yicha so'nggi 24 soat ichida ariza topshirgansiz. "
-                    "Iltimos, biroz kuting yoki boshqa vakansiya tanlang."
-                )
-        
+        return _insert_application(conn.cursor(), data)
+
+
+def _insert_application(c: sqlite3.Cursor, data: Dict[str, Any]) -> int:
+    """Duplicate check + INSERT for one application (runs inside the caller's transaction)."""
+    # Check for duplicate: same phone + vacancy within last 24 hours.
+    # The in-memory window answers the common "not a duplicate" case; a hit is
+    # confirmed with the (phone_norm, vacancy, created_at) index.
+    phone_norm = normalize_phone(data.get("phone"))
+    vacancy = data.get("vacancy")
+    if phone_norm and vacancy and recent_applications.contains(c, phone_norm, vacancy):
         c.execute(
             """
-            INSERT INTO applicants
-            (name, age, phone, vacancy, subject, experience, workplace, username, photo_id, cv_file_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            SELECT id FROM applicants
+            WHERE phone_norm = ? AND vacancy = ?
+            AND created_at > datetime('now', ?)
+            LIMIT 1
         """,
-            (
-                data.get("name"),
-                data.get("age"),
-                data.get("phone"),
-                data.get("vacancy"),
-                data.get("subject"),
-                data.get("experience"),
-                data.get("workplace"),
-                data.get("username"),
-                data.get("photo_id"),
-                data.get("cv_file_id"),
-            ),
+            (phone_norm, vacancy, f"-{DUPLICATE_WINDOW} seconds"),
         )
-        conn.commit()
-        return c.lastrowid
+        if c.fetchone():
+            logger.warning(f"Duplicate application detected: phone={phone_norm}, vacancy={vacancy}")
+            raise ValueError(
+                "Siz bu vakansiya bo'yicha so'nggi 24 soat ichida ariza topshirgansiz. "
+                "Iltimos, biroz kuting yoki boshqa vakansiya tanlang."
+            )
+
+    c.execute(
+        """
+        INSERT INTO applicants
+        (name, age, phone, phone_norm, vacancy, subject, experience, workplace, username, photo_id, cv_file_id,
+         user_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """,
+        (
+            data.get("name"),
+            data.get("age"),
+            data.get("phone"),
+            phone_norm,
+            vacancy,
+            data.get("subject"),
+            data.get("experience"),
+            data.get("workplace"),
+            data.get("username"),
+            data.get("photo_id"),
+            data.get("cv_file_id"),
+            data.get("user_id"),
+        ),
+    )
+    if phone_norm and vacancy:
+        recent_applications.add(phone_norm, vacancy, c.lastrowid)
+    return c.lastrowid
 
 
 def get_last_applicants(limit: int = 5, vacancy: str | None = None) -> List[Tuple]:
@@ -232,7 +669,7 @@ def get_last_applicants(limit: int = 5, vacancy: str | None = None) -> List[Tupl
     Returns:
         List of applicant records
     """
-    with db_connection() as conn:
+    with db_connection(readonly=True) as conn:
         c = conn.cursor()
         if vacancy:
             c.execute(
@@ -258,6 +695,88 @@ def get_last_applicants(limit: int = 5, vacancy: str | None = None) -> List[Tupl
         return c.fetchall()
 
 
+class Page(NamedTuple):
+    """One page of a keyset-paginated listing (rows newest first)."""
+    rows: List[sqlite3.Row]
+    has_older: bool
+    has_newer: bool
+
+
+def _keyset_page(
+    c: sqlite3.Cursor,
+    table: str,
+    columns: str,
+    filter_column: str,
+    filter_value: str | None,
+    before_id: int | None,
+    after_id: int | None,
+    limit: int,
+) -> Page:
+    """
+    Fetch one page ordered by id DESC without OFFSET.
+    before_id pages towards older rows, after_id towards newer ones; with
+    neither, the newest page is returned. Each page is one range scan on the
+    primary key (or on the (filter_column, rowid) index when filtering).
+    """
+    where, params = "", []
+    if filter_value:
+        where, params = f" AND {filter_column} = ?", [filter_value]
+
+    def exists(condition: str, boundary: int) -> bool:
+        c.execute(f"SELECT 1 FROM {table} WHERE {condition}{where} LIMIT 1", (boundary, *params))
+        return c.fetchone() is not None
+
+    if after_id is not None:
+        c.execute(
+            f"SELECT {columns} FROM {table} WHERE id > ?{where} ORDER BY id ASC LIMIT ?",
+            (after_id, *params, limit + 1),
+        )
+        rows = c.fetchall()
+        has_newer = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_older = bool(rows) and exists("id < ?", rows[-1]["id"])
+        return Page(rows, has_older, has_newer)
+
+    if before_id is not None:
+        c.execute(
+            f"SELECT {columns} FROM {table} WHERE id < ?{where} ORDER BY id DESC LIMIT ?",
+            (before_id, *params, limit + 1),
+        )
+    else:
+        c.execute(
+            f"SELECT {columns} FROM {table} WHERE 1{where} ORDER BY id DESC LIMIT ?",
+            (*params, limit + 1),
+        )
+    rows = c.fetchall()
+    has_older = len(rows) > limit
+    rows = rows[:limit]
+    has_newer = before_id is not None and bool(rows) and exists("id > ?", rows[0]["id"])
+    return Page(rows, has_older, has_newer)
+
+
+def get_applicants_page(
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 5,
+    vacancy: str | None = None,
+) -> Page:
+    """
+    Return one page of applicants for admin browsing (keyset on id).
+
+    Args:
+        before_id: Return applicants older than this id
+        after_id: Return applicants newer than this id
+        limit: Page size
+        vacancy: Filter by vacancy (optional)
+    """
+    with db_connection(readonly=True) as conn:
+        return _keyset_page(
+            conn.cursor(), "applicants",
+            "id, name, phone, vacancy, subject, experience, workplace",
+            "vacancy", vacancy, before_id, after_id, limit,
+        )
+
+
 def get_all_applicants(vacancy: str | None = None) -> List[Tuple]:
     """
     Return all applicants, optionally filtered by vacancy.
@@ -268,12 +787,12 @@ def get_all_applicants(vacancy: str | None = None) -> List[Tuple]:
     Returns:
         List of all applicant records
     """
-    with db_connection() as conn:
+    with db_connection(readonly=True) as conn:
         c = conn.cursor()
         if vacancy:
-            c.execute("SELECT * FROM applicants WHERE vacancy=?", (vacancy,))
+            c.execute(f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants WHERE vacancy=?", (vacancy,))
         else:
-            c.execute("SELECT * FROM applicants")
+            c.execute(f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants")
         return c.fetchall()
 
 
@@ -288,25 +807,28 @@ def save_support_ticket(data: Dict[str, Any]) -> int:
         Inserted row ID
     """
     with db_connection() as conn:
-        c = conn.cursor()
-        c.execute(
-            """
-            INSERT INTO support_tickets
-            (user_id, username, phone, category, question, question_voice_id, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                data.get("user_id"),
-                data.get("username"),
-                data.get("phone"),
-                data.get("category"),
-                data.get("question"),
-                data.get("question_voice_id"),
-                data.get("status", "pending"),
-            ),
-        )
-        conn.commit()
-        return c.lastrowid
+        return _insert_support_ticket(conn.cursor(), data)
+
+
+def _insert_support_ticket(c: sqlite3.Cursor, data: Dict[str, Any]) -> int:
+    """INSERT one row into support_tickets (runs inside the caller's transaction)."""
+    c.execute(
+        """
+        INSERT INTO support_tickets
+        (user_id, username, phone, category, question, question_voice_id, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+        (
+            data.get("user_id"),
+            data.get("username"),
+            data.get("phone"),
+            data.get("category"),
+            data.get("question"),
+            data.get("question_voice_id"),
+            data.get("status", "pending"),
+        ),
+    )
+    return c.lastrowid
 
 
 def get_support_tickets(limit: int = 5, category: str | None = None) -> List[Tuple]:
@@ -320,7 +842,7 @@ def get_support_tickets(limit: int = 5, category: str | None = None) -> List[Tup
     Returns:
         List of ticket records (id, user_id, username, phone, category, question, question_voice_id, created_at)
     """
-    with db_connection() as conn:
+    with db_connection(readonly=True) as conn:
         c = conn.cursor()
         if category:
             c.execute(
@@ -346,48 +868,22 @@ def get_support_tickets(limit: int = 5, category: str | None = None) -> List[Tup
         return c.fetchall()
 
 
-def export_support_tickets_to_excel(category: str | None = None, limit: int = 5000) -> str | None:
+def get_support_tickets_page(
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 10,
+    category: str | None = None,
+) -> Page:
     """
-    Export support tickets to Excel. Returns file path or None.
-    
-    Args:
-        category: Filter by category (optional)
-        limit: Maximum number of records to export (default: 5000, max: 10000)
+    Return one page of support tickets for admin browsing (keyset on id).
+    Rows have the same columns as get_support_tickets().
     """
-    import openpyxl
-    # Limit to prevent memory issues
-    limit = min(limit, 10000)
-    rows = get_support_tickets(limit=limit, category=category)
-    if not rows:
-        return None
-
-    file_name = f"support_tickets_{category}.xlsx" if category else "support_tickets_all.xlsx"
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Support tickets"
-
-    headers = [
-        "ID",
-        "User ID",
-        "Username",
-        "Phone",
-        "Category",
-        "Question",
-        "Voice ID",
-        "Created at",
-    ]
-    ws.append(headers)
-    for row in rows:
-        # Convert sqlite3.Row to tuple/list
-        if hasattr(row, 'keys'):
-            # It's a Row object, convert to list
-            row_data = [row[i] for i in range(len(row))]
-        else:
-            # It's already a tuple/list
-            row_data = list(row)
-        ws.append(row_data)
-    wb.save(file_name)
-    return file_name
+    with db_connection(readonly=True) as conn:
+        return _keyset_page(
+            conn.cursor(), "support_tickets",
+            "id, user_id, username, phone, category, question, question_voice_id, created_at",
+            "category", category, before_id, after_id, limit,
+        )
 
 
 def save_course_lead(data: Dict[str, Any]) -> int:
@@ -401,20 +897,684 @@ def save_course_lead(data: Dict[str, Any]) -> int:
         Inserted row ID
     """
     with db_connection() as conn:
-        c = conn.cursor()
-        c.execute(
+        return _insert_course_lead(conn.cursor(), data)
+
+
+def _insert_course_lead(c: sqlite3.Cursor, data: Dict[str, Any]) -> int:
+    """INSERT one row into course_leads (runs inside the caller's transaction)."""
+    c.execute(
+        """
+        INSERT INTO course_leads
+        (user_id, username, course_name, tariff, phone)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        (
+            data.get("user_id"),
+            data.get("username"),
+            data.get("course_name"),
+            data.get("tariff"),
+            data.get("phone"),
+        ),
+    )
+    return c.lastrowid
+
+
+# ==========================
+#   FSM STORAGE
+# ==========================
+
+
+def load_fsm_record(key: str) -> Tuple[str | None, str, int] | None:
+    """Return (state, data JSON, updated_at) stored for an FSM key, or None if there is none."""
+    with db_connection(readonly=True) as conn:
+        return conn.execute(
+            "SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (key,)
+        ).fetchone()
+
+
+def _write_fsm_records(c: sqlite3.Cursor, records: List[Tuple[str, str | None, str | None]]) -> int:
+    """
+    Upsert a batch of (key, state, data JSON) records; data None deletes the key.
+    Runs inside the caller's transaction and returns the number of records.
+    """
+    now = int(time.time())
+    upserts = [(key, state, data, now) for key, state, data in records if data is not None]
+    deletes = [(key,) for key, _, data in records if data is None]
+    if upserts:
+        c.executemany(
             """
-            INSERT INTO course_leads
-            (user_id, username, course_name, tariff, phone)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
         """,
-            (
-                data.get("user_id"),
-                data.get("username"),
-                data.get("course_name"),
-                data.get("tariff"),
-                data.get("phone"),
-            ),
+            upserts,
+        )
+    if deletes:
+        c.executemany("DELETE FROM fsm_storage WHERE key = ?", deletes)
+    return len(records)
+
+
+def _purge_fsm_records(c: sqlite3.Cursor, older_than: int) -> int:
+    """Delete FSM records last written before the `older_than` unix time; returns the count."""
+    c.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (older_than,))
+    return c.rowcount
+
+
+# ==========================
+#   OUTBOX (staff notifications)
+# ==========================
+# A notification is written in the same transaction as the application,
+# ticket or lead it announces, so it can neither be lost nor sent for a row
+# that was rolled back. outbox.OutboxWorker delivers it afterwards.
+
+# Keep delivered/failed outbox rows this long (for inspection), then purge
+OUTBOX_RETENTION_DAYS = 7
+
+
+class Notification(NamedTuple):
+    """Staff notification for a row being inserted."""
+
+    kind: str  # dedup key prefix, e.g. "application"
+    recipients: List[int]
+    # Inserted row id -> Bot API steps, e.g. [{"method": "send_message", "text": ...}]
+    render: Callable[[int], List[Dict[str, Any]]]
+
+
+def _enqueue_notification(c: sqlite3.Cursor, notification: Notification, row_id: int) -> None:
+    """Add one outbox row per recipient; a (kind, row, chat) already queued is ignored."""
+    steps = json.dumps(notification.render(row_id), ensure_ascii=False)
+    now = time.time()
+    c.executemany(
+        "INSERT OR IGNORE INTO outbox (dedup_key, chat_id, steps, next_attempt_at) VALUES (?, ?, ?, ?)",
+        [
+            (f"{notification.kind}:{row_id}:{chat_id}", chat_id, steps, now)
+            for chat_id in dict.fromkeys(notification.recipients)
+        ],
+    )
+
+
+def _insert_and_notify(
+    c: sqlite3.Cursor,
+    insert: Callable[[sqlite3.Cursor, Dict[str, Any]], int],
+    data: Dict[str, Any],
+    notification: Notification | None,
+) -> int:
+    """Run an insert helper and queue its notification in the same transaction."""
+    row_id = insert(c, data)
+    if notification is not None:
+        _enqueue_notification(c, notification, row_id)
+    return row_id
+
+
+def _claim_outbox_batch(c: sqlite3.Cursor, now: float, limit: int, claim_timeout: float) -> List[Tuple]:
+    """
+    Mark up to `limit` due pending rows as 'sending' and return them as
+    (id, chat_id, steps JSON, steps_done, attempts). Rows claimed more than
+    `claim_timeout` seconds ago and still 'sending' (their outcome was never
+    recorded) are claimed again.
+    """
+    c.execute(
+        """
+        UPDATE outbox SET status = 'sending', claimed_at = ?
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'sending' AND COALESCE(claimed_at, 0) < ?)
+            ORDER BY next_attempt_at
+            LIMIT ?
+        )
+        RETURNING id, chat_id, steps, steps_done, attempts
+    """,
+        (now, now, now - claim_timeout, limit),
+    )
+    return [tuple(row) for row in c.fetchall()]
+
+
+def _update_outbox(
+    c: sqlite3.Cursor,
+    outbox_id: int,
+    status: str,
+    steps_done: int,
+    attempts: int,
+    next_attempt_at: float | None = None,
+    last_error: str | None = None,
+) -> None:
+    """Record the outcome of a delivery attempt ('sent', 'pending' for a retry, or 'failed')."""
+    c.execute(
+        """
+        UPDATE outbox SET
+            status = ?, steps_done = ?, attempts = ?,
+            next_attempt_at = COALESCE(?, next_attempt_at), last_error = ?,
+            sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP ELSE sent_at END
+        WHERE id = ?
+    """,
+        (status, steps_done, attempts, next_attempt_at, last_error, status, outbox_id),
+    )
+
+
+def _recover_outbox(c: sqlite3.Cursor) -> int:
+    """
+    Crash recovery at startup: rows left in 'sending' go back to 'pending'
+    (they resume at steps_done), and old finished rows are purged.
+    Returns the number of recovered rows.
+    """
+    c.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+    recovered = c.rowcount
+    c.execute(
+        "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < datetime('now', ?)",
+        (f"-{OUTBOX_RETENTION_DAYS} days",),
+    )
+    return recovered
+
+
+def next_outbox_attempt_at() -> float | None:
+    """Time of the earliest pending delivery, or None if nothing is pending."""
+    with db_connection(readonly=True) as conn:
+        return conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+        ).fetchone()[0]
+
+
+# ==========================
+#   BROADCASTS
+# ==========================
+
+# Everyone who ever applied, asked support or left a course lead, in user_id
+# order. Each branch is a range scan on a user_id index, and UNION removes
+# duplicates, so recipients can be paged with a `user_id > last` checkpoint.
+_BROADCAST_RECIPIENTS_SQL = """
+    SELECT user_id FROM applicants WHERE user_id > :after
+    UNION SELECT user_id FROM support_tickets WHERE user_id > :after
+    UNION SELECT user_id FROM course_leads WHERE user_id > :after
+"""
+
+
+def get_broadcast_recipients(after_user_id: int, limit: int) -> List[int]:
+    """Next `limit` unique recipient ids greater than after_user_id, ascending."""
+    with db_connection(readonly=True) as conn:
+        rows = conn.execute(
+            f"{_BROADCAST_RECIPIENTS_SQL} ORDER BY user_id LIMIT :limit",
+            {"after": after_user_id, "limit": limit},
+        ).fetchall()
+        return [row[0] for row in rows]
+
+
+def count_broadcast_recipients() -> int:
+    """Number of unique broadcast recipients."""
+    with db_connection(readonly=True) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM ({_BROADCAST_RECIPIENTS_SQL})", {"after": 0}).fetchone()[0]
+
+
+def get_running_broadcast() -> Tuple | None:
+    """
+    The unfinished broadcast, if any, as (id, text, total, last_user_id,
+    delivered, blocked, failed, status_chat_id, status_message_id).
+    """
+    with db_connection(readonly=True) as conn:
+        row = conn.execute(
+            """
+            SELECT id, text, total, last_user_id, delivered, blocked, failed, status_chat_id, status_message_id
+            FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1
+        """
+        ).fetchone()
+        return tuple(row) if row else None
+
+
+def _create_broadcast(
+    c: sqlite3.Cursor, text: str, created_by: int, total: int, status_chat_id: int, status_message_id: int
+) -> int:
+    """Insert a running broadcast and return its id."""
+    c.execute(
+        """
+        INSERT INTO broadcasts (text, created_by, total, status_chat_id, status_message_id)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        (text, created_by, total, status_chat_id, status_message_id),
+    )
+    return c.lastrowid
+
+
+def _checkpoint_broadcast(
+    c: sqlite3.Cursor,
+    broadcast_id: int,
+    last_user_id: int,
+    delivered: int,
+    blocked: int,
+    failed: int,
+    status: str = "running",
+) -> None:
+    """Save progress: every recipient up to last_user_id has been handled."""
+    c.execute(
+        """
+        UPDATE broadcasts SET
+            last_user_id = ?, delivered = ?, blocked = ?, failed = ?, status = ?,
+            finished_at = CASE WHEN ? = 'running' THEN NULL ELSE CURRENT_TIMESTAMP END
+        WHERE id = ?
+    """,
+        (last_user_id, delivered, blocked, failed, status, status, broadcast_id),
+    )
+
+
+# ==========================
+#   EXCEL EXPORT (streaming)
+# ==========================
+
+APPLICANT_EXPORT_HEADERS = [
+    "ID",
+    "Ism",
+    "Yosh",
+    "Telefon",
+    "Vakansiya",
+    "Yo'nalish",
+    "Tajriba",
+    "Ish joyi",
+    "Username",
+    "Rasm",
+    "CV",
+    "Sana",
+]
+
+SUPPORT_TICKET_EXPORT_HEADERS = [
+    "ID",
+    "User ID",
+    "Username",
+    "Phone",
+    "Category",
+    "Question",
+    "Voice ID",
+    "Created at",
+]
+
+
+def _iter_rows(query: str, params: tuple, chunk_size: int) -> Iterator[tuple]:
+    """Yield query rows as tuples, fetching `chunk_size` rows at a time."""
+    with db_connection(readonly=True) as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        while True:
+            chunk = c.fetchmany(chunk_size)
+            if not chunk:
+                return
+            for row in chunk:
+                yield tuple(row)
+
+
+def iter_applicants(vacancy: str | None = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    """Stream applicant export rows (APPLICANT_EXPORT_COLUMNS), oldest first."""
+    if vacancy:
+        return _iter_rows(
+            f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants WHERE vacancy=? ORDER BY id",
+            (vacancy,), chunk_size,
+        )
+    return _iter_rows(f"SELECT {APPLICANT_EXPORT_COLUMNS} FROM applicants ORDER BY id", (), chunk_size)
+
+
+def iter_support_tickets(category: str | None = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    """Stream support ticket export rows, newest first."""
+    columns = "id, user_id, username, phone, category, question, question_voice_id, created_at"
+    if category:
+        return _iter_rows(
+            f"SELECT {columns} FROM support_tickets WHERE category=? ORDER BY id DESC",
+            (category,), chunk_size,
         )
-        conn.commit()
-        return c.lastrowid
+    return _iter_rows(f"SELECT {columns} FROM support_tickets ORDER BY id DESC", (), chunk_size)
+
+
+def write_xlsx(
+    target,
+    title: str,
+    headers: List[str],
+    rows: Iterator[tuple],
+    progress: Callable[[int], None] | None = None,
+) -> int:
+    """
+    Write rows into a write-only (streaming) workbook and return the row count.
+    Rows go straight to the sheet's XML stream, so memory stays flat
+    however many rows there are. `progress(rows_written)` is called every
+    EXPORT_CHUNK_SIZE rows.
+    """
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(headers)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+        if progress and count % EXPORT_CHUNK_SIZE == 0:
+            progress(count)
+    wb.save(target)
+    return count
+
+
+def _export(
+    title: str,
+    headers: List[str],
+    rows: Iterator[tuple],
+    progress: Callable[[int], None] | None = None,
+) -> bytes | None:
+    """Render rows into an in-memory .xlsx, or return None if there are none."""
+    first = next(rows, None)
+    if first is None:
+        return None
+    buffer = io.BytesIO()
+    write_xlsx(buffer, title, headers, itertools.chain([first], rows), progress)
+    return buffer.getvalue()
+
+
+def export_file_name(prefix: str, filter_value: str | None = None) -> str:
+    """Unique download name for an export, e.g. arizalar_Mentor_20250101_120000_1a2b3c.xlsx."""
+    label = re.sub(r"[^\w-]+", "_", filter_value) if filter_value else "all"
+    return f"{prefix}_{label}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}.xlsx"
+
+
+def count_applicants(vacancy: str | None = None) -> int:
+    """Number of rows export_applicants_to_excel() would write."""
+    with db_connection(readonly=True) as conn:
+        if vacancy:
+            return conn.execute("SELECT COUNT(*) FROM applicants WHERE vacancy=?", (vacancy,)).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM applicants").fetchone()[0]
+
+
+def count_support_tickets(category: str | None = None) -> int:
+    """Number of rows export_support_tickets_to_excel() would write."""
+    with db_connection(readonly=True) as conn:
+        if category:
+            return conn.execute(
+                "SELECT COUNT(*) FROM support_tickets WHERE category=?", (category,)
+            ).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM support_tickets").fetchone()[0]
+
+
+def export_applicants_to_excel(
+    vacancy: str | None = None, progress: Callable[[int], None] | None = None
+) -> bytes | None:
+    """Export applicants to an in-memory Excel file. Returns its bytes or None."""
+    return _export("Arizalar", APPLICANT_EXPORT_HEADERS, iter_applicants(vacancy), progress)
+
+
+def export_support_tickets_to_excel(
+    category: str | None = None, progress: Callable[[int], None] | None = None
+) -> bytes | None:
+    """
+    Export support tickets to an in-memory Excel file. Returns its bytes or None.
+    
+    Args:
+        category: Filter by category (optional)
+        progress: Called with the number of rows written so far (optional)
+    """
+    return _export(
+        "Support tickets", SUPPORT_TICKET_EXPORT_HEADERS, iter_support_tickets(category), progress
+    )
+
+
+# ==========================
+#   ASYNC API (aiogram handlers)
+# ==========================
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return the DB executor, creating it on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+        )
+    return _executor
+
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a blocking DB function on the dedicated DB executor.
+    The event loop keeps serving other updates while SQLite works or waits for a lock.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(func, *args, **kwargs))
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Stop the DB executor (pending calls finish first when wait=True)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def _run_write_batch(items: List[Tuple[Callable[..., Any], tuple]]) -> List[Tuple[bool, Any]]:
+    """
+    Run a batch of insert functions in ONE write transaction.
+    Every item gets its own SAVEPOINT, so a rejected row (e.g. a duplicate
+    application) is rolled back alone and the rest of the batch still commits.
+    Returns (ok, result_or_exception) per item, in order.
+    """
+    results: List[Tuple[bool, Any]] = []
+    with db_connection() as conn:
+        c = conn.cursor()
+        for func, args in items:
+            c.execute("SAVEPOINT batch_item")
+            try:
+                results.append((True, func(c, *args)))
+            except Exception as e:
+                c.execute("ROLLBACK TO batch_item")
+                results.append((False, e))
+            c.execute("RELEASE batch_item")
+    return results
+
+
+class WriteQueue:
+    """
+    Group commit for inserts coming from many handlers at the same time.
+
+    A single writer task collects pending inserts for up to `max_delay`
+    seconds or `max_rows` rows, whichever comes first, and runs them in one
+    transaction per batch on the DB executor, with a SAVEPOINT per item so
+    a failing item is rolled back alone. Each caller awaits a future that
+    resolves to its row id only after COMMIT has returned, so nothing is
+    acknowledged before it is committed (with WAL and synchronous=NORMAL a
+    commit survives a crash of the bot, not necessarily a power loss).
+    """
+
+    def __init__(self, max_rows: int = WRITE_BATCH_MAX_ROWS, max_delay: float = WRITE_BATCH_MAX_DELAY):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._full: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def _ensure_started(self) -> None:
+        """Start the writer task on the running loop (lazily, on first submit)."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._run(), name="db-write-queue")
+
+    async def submit(self, func: Callable[..., T], *args: Any) -> T:
+        """Queue `func(cursor, *args)` for the next batch and wait for its result."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._queue.put_nowait((func, args, future))
+        if self._queue.qsize() >= self.max_rows:
+            self._full.set()
+        return await future
+
+    async def _run(self) -> None:
+        """Writer loop: wait for work, gather a batch, commit it."""
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            # Give concurrent submitters a moment to join this batch
+            if self._queue.qsize() < self.max_rows - 1:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+
+            batch = [first]
+            stop = False
+            while len(batch) < self.max_rows and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+            if stop:
+                return
+
+    async def _commit(self, batch: list) -> None:
+        """Run one batch and resolve the callers' futures."""
+        try:
+            results = await run_db(_run_write_batch, [(func, args) for func, args, _ in batch])
+        except Exception as e:
+            logger.exception(f"Write batch of {len(batch)} rows failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():  # caller was cancelled; the row is committed anyway
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close(self) -> None:
+        """Commit everything already queued, then stop the writer task."""
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+
+
+write_queue = WriteQueue()
+
+
+async def save_application_async(data: Dict[str, Any], notification: Notification | None = None) -> int:
+    """Async version of save_application() (group-committed, with its outbox notification)."""
+    return await write_queue.submit(_insert_and_notify, _insert_application, data, notification)
+
+
+async def save_support_ticket_async(data: Dict[str, Any], notification: Notification | None = None) -> int:
+    """Async version of save_support_ticket() (group-committed, with its outbox notification)."""
+    return await write_queue.submit(_insert_and_notify, _insert_support_ticket, data, notification)
+
+
+async def save_course_lead_async(data: Dict[str, Any], notification: Notification | None = None) -> int:
+    """Async version of save_course_lead() (group-committed, with its outbox notification)."""
+    return await write_queue.submit(_insert_and_notify, _insert_course_lead, data, notification)
+
+
+async def claim_outbox_batch_async(now: float, limit: int, claim_timeout: float) -> List[Tuple]:
+    """Claim due outbox rows for delivery (see _claim_outbox_batch)."""
+    return await write_queue.submit(_claim_outbox_batch, now, limit, claim_timeout)
+
+
+async def update_outbox_async(
+    outbox_id: int,
+    status: str,
+    steps_done: int,
+    attempts: int,
+    next_attempt_at: float | None = None,
+    last_error: str | None = None,
+) -> None:
+    """Record a delivery outcome through the group-commit write queue."""
+    await write_queue.submit(_update_outbox, outbox_id, status, steps_done, attempts, next_attempt_at, last_error)
+
+
+async def recover_outbox_async() -> int:
+    """Async version of _recover_outbox()."""
+    return await write_queue.submit(_recover_outbox)
+
+
+async def next_outbox_attempt_at_async() -> float | None:
+    """Async version of next_outbox_attempt_at()."""
+    return await run_db(next_outbox_attempt_at)
+
+
+async def write_fsm_records_async(records: List[Tuple[str, str | None, str | None]]) -> int:
+    """Write a batch of FSM records through the group-commit write queue."""
+    return await write_queue.submit(_write_fsm_records, records)
+
+
+async def purge_fsm_records_async(older_than: int) -> int:
+    """Delete expired FSM records through the group-commit write queue."""
+    return await write_queue.submit(_purge_fsm_records, older_than)
+
+
+async def load_fsm_record_async(key: str) -> Tuple[str | None, str, int] | None:
+    """Async version of load_fsm_record()."""
+    return await run_db(load_fsm_record, key)
+
+
+async def get_broadcast_recipients_async(after_user_id: int, limit: int) -> List[int]:
+    """Async version of get_broadcast_recipients()."""
+    return await run_db(get_broadcast_recipients, after_user_id, limit)
+
+
+async def count_broadcast_recipients_async() -> int:
+    """Async version of count_broadcast_recipients()."""
+    return await run_db(count_broadcast_recipients)
+
+
+async def get_running_broadcast_async() -> Tuple | None:
+    """Async version of get_running_broadcast()."""
+    return await run_db(get_running_broadcast)
+
+
+async def create_broadcast_async(
+    text: str, created_by: int, total: int, status_chat_id: int, status_message_id: int
+) -> int:
+    """Create a broadcast through the group-commit write queue."""
+    return await write_queue.submit(_create_broadcast, text, created_by, total, status_chat_id, status_message_id)
+
+
+async def checkpoint_broadcast_async(
+    broadcast_id: int, last_user_id: int, delivered: int, blocked: int, failed: int, status: str = "running"
+) -> None:
+    """Save broadcast progress through the group-commit write queue."""
+    await write_queue.submit(
+        _checkpoint_broadcast, broadcast_id, last_user_id, delivered, blocked, failed, status
+    )
+
+
+async def get_last_applicants_async(limit: int = 5, vacancy: str | None = None) -> List[Tuple]:
+    """Async version of get_last_applicants()."""
+    return await run_db(get_last_applicants, limit, vacancy)
+
+
+async def get_all_applicants_async(vacancy: str | None = None) -> List[Tuple]:
+    """Async version of get_all_applicants()."""
+    return await run_db(get_all_applicants, vacancy)
+
+
+async def get_applicants_page_async(
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 5,
+    vacancy: str | None = None,
+) -> Page:
+    """Async version of get_applicants_page()."""
+    return await run_db(get_applicants_page, before_id, after_id, limit, vacancy)
+
+
+async def get_support_tickets_page_async(
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 10,
+    category: str | None = None,
+) -> Page:
+    """Async version of get_support_tickets_page()."""
+    return await run_db(get_support_tickets_page, before_id, after_id, limit, category)
+
+
+async def get_support_tickets_async(limit: int = 5, category: str | None = None) -> List[Tuple]:
+    """Async version of get_support_tickets()."""
+    return await run_db(get_support_tickets, limit, category)
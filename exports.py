@@ -0,0 +1,229 @@
+"""
+Excel export jobs for the aiogram bot.
+Workbooks are built in a process pool, so openpyxl serialization uses spare
+cores and never blocks the event loop that serves user traffic.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Set, Tuple
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Worker processes for export jobs (leave one core for the bot itself)
+EXPORT_WORKERS = max(1, min(2, (os.cpu_count() or 2) - 1))
+# Seconds between "export in progress N%" updates
+PROGRESS_INTERVAL = 2.0
+# Seconds a running export may take to finish at shutdown before its worker is terminated
+EXPORT_SHUTDOWN_TIMEOUT = 10.0
+
+# Sent exports are reused while their table is unchanged, for at most this long
+EXPORT_CACHE_TTL = 24 * 3600
+EXPORT_CACHE_MAX_ENTRIES = 64
+
+# kind -> (exporter, row counter, source table); exporter and counter take the optional filter value
+EXPORTS: Dict[str, Tuple[Callable, Callable, str]] = {
+    "applicants": (db.export_applicants_to_excel, db.count_applicants, "applicants"),
+    "support_tickets": (db.export_support_tickets_to_excel, db.count_support_tickets, "support_tickets"),
+}
+
+
+# ==========================
+#   WORKER PROCESS SIDE
+# ==========================
+
+_worker_progress_queue = None
+
+
+def _init_worker(progress_queue) -> None:
+    """Process pool initializer: keep the queue used to report progress and announce this worker."""
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    progress_queue.put(("started", os.getpid()))
+
+
+def _run_job(job_id: str, kind: str, filter_value: str | None) -> bytes | None:
+    """Build one export in a worker process. Returns the .xlsx bytes or None."""
+    exporter, counter, _ = EXPORTS[kind]
+    total = counter(filter_value)
+
+    def progress(done: int) -> None:
+        _worker_progress_queue.put(("progress", job_id, done, total))
+
+    return exporter(filter_value, progress=progress)
+
+
+# ==========================
+#   BOT PROCESS SIDE
+# ==========================
+
+_pool: ProcessPoolExecutor | None = None
+_progress_queue = None
+_progress_thread: threading.Thread | None = None
+# job_id -> (rows_done, rows_total) of running jobs: registered by run_export,
+# updated by the progress reader thread
+_progress: Dict[str, Tuple[int, int]] = {}
+_progress_lock = threading.Lock()
+# Pids of the pool's worker processes, announced by _init_worker
+_worker_pids: Set[int] = set()
+# Submitted jobs that have not finished yet
+_jobs: Set[futures.Future] = set()
+
+
+def _read_progress(progress_queue) -> None:
+    """Background thread: move worker progress reports into _progress."""
+    while True:
+        item = progress_queue.get()
+        if item is None:
+            return
+        if item[0] == "started":
+            _worker_pids.add(item[1])
+            continue
+        _, job_id, done, total = item
+        with _progress_lock:
+            # A report that arrives after its job finished must not bring the entry back
+            if job_id in _progress:
+                _progress[job_id] = (done, total)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Start the process pool and progress reader on first use."""
+    global _pool, _progress_queue, _progress_thread
+    if _pool is None:
+        # spawn, not fork: the bot process runs DB and event loop threads,
+        # and forking while one of them holds a lock can deadlock the child
+        ctx = multiprocessing.get_context("spawn")
+        _progress_queue = ctx.Queue()
+        _pool = ProcessPoolExecutor(
+            max_workers=EXPORT_WORKERS,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(_progress_queue,),
+        )
+        _progress_thread = threading.Thread(
+            target=_read_progress, args=(_progress_queue,), name="export-progress", daemon=True
+        )
+        _progress_thread.start()
+    return _pool
+
+
+async def run_export(
+    kind: str,
+    filter_value: str | None = None,
+    on_progress: Callable[[int], Awaitable[None]] | None = None,
+) -> bytes | None:
+    """
+    Run an export job in the process pool and return the .xlsx bytes (or None if empty).
+    `on_progress(percent)` is awaited every PROGRESS_INTERVAL seconds while the job runs.
+    """
+    job_id = uuid.uuid4().hex
+    last_percent = None
+    _progress[job_id] = (0, 0)
+    try:
+        job = _get_pool().submit(_run_job, job_id, kind, filter_value)
+        _jobs.add(job)
+        job.add_done_callback(_jobs.discard)
+        future = asyncio.wrap_future(job)
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=PROGRESS_INTERVAL)
+            if done:
+                return future.result()
+            rows_done, total = _progress[job_id]
+            if on_progress and total:
+                percent = min(99, rows_done * 100 // max(total, 1))
+                if percent != last_percent:
+                    last_percent = percent
+                    try:
+                        await on_progress(percent)
+                    except Exception as e:
+                        logger.warning(f"Export progress callback failed: {e}")
+    finally:
+        with _progress_lock:
+            _progress.pop(job_id, None)
+
+
+class ExportCache:
+    """
+    Telegram file_id of the last export sent per (kind, filter).
+
+    An entry is valid only for the table data version it was built from
+    (see db.get_data_version), so any new or changed row invalidates it.
+    Entries also expire after `ttl` seconds, and the least recently used
+    ones are dropped beyond `max_entries`.
+    """
+
+    def __init__(self, ttl: float = EXPORT_CACHE_TTL, max_entries: int = EXPORT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (kind, filter) -> (data_version, file_id, stored_at)
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, kind: str, filter_value: str | None, version: int) -> str | None:
+        """Return the cached file_id if the data has not changed since it was sent."""
+        key = (kind, filter_value)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        cached_version, file_id, stored_at = entry
+        if cached_version != version or time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return file_id
+
+    def put(self, kind: str, filter_value: str | None, version: int, file_id: str) -> None:
+        """Remember the file_id Telegram returned for a freshly sent export."""
+        key = (kind, filter_value)
+        self._entries[key] = (version, file_id, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, kind: str, filter_value: str | None) -> None:
+        """Forget an entry (e.g. Telegram rejected the cached file_id)."""
+        self._entries.pop((kind, filter_value), None)
+
+
+export_cache = ExportCache()
+
+
+async def get_export_version(kind: str) -> int:
+    """Current data version of the table behind an export kind."""
+    return await db.run_db(db.get_data_version, EXPORTS[kind][2])
+
+
+async def shutdown(timeout: float = EXPORT_SHUTDOWN_TIMEOUT) -> None:
+    """
+    Stop the process pool and the progress reader (used on bot shutdown).
+    Queued exports are cancelled; running ones get `timeout` seconds (waited
+    for off the event loop), then their worker processes are terminated.
+    """
+    global _pool, _progress_queue, _progress_thread
+    if _pool is None:
+        return
+    pool, progress_queue, progress_thread = _pool, _progress_queue, _progress_thread
+    _pool = _progress_queue = _progress_thread = None
+    pool.shutdown(wait=False, cancel_futures=True)
+    loop = asyncio.get_running_loop()
+    running = [job for job in _jobs if not job.done()]
+    if running:
+        _, unfinished = await loop.run_in_executor(None, futures.wait, running, timeout)
+        if unfinished:
+            logger.warning(f"Terminating {len(unfinished)} export(s) still running after {timeout:.0f}s")
+            # The executor exposes no workers: match the pids they announced
+            # against our live child processes (so a reused pid is never hit)
+            for process in multiprocessing.active_children():
+                if process.pid in _worker_pids:
+                    process.terminate()
+    _worker_pids.clear()
+    progress_queue.put(None)
+    await loop.run_in_executor(None, progress_thread.join, 5)
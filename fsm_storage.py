@@ -0,0 +1,262 @@
+"""
+Persistent aiogram FSM storage on the bot's SQLite database.
+
+Half-filled forms (HRForm, SupportForm, CoursesForm) survive restarts,
+while each FSM step stays in memory: reads are served from an in-process
+cache (loaded from the fsm_storage table on first access), and changed
+keys are written back in one batch every FSM_FLUSH_INTERVAL seconds.
+
+Like the legacy app.py sessions, a form that has not changed for
+SESSION_TIMEOUT seconds expires, and at most FSM_MAX_ENTRIES keys are
+kept in memory (least recently used ones are evicted, but stay on disk).
+Data of the known forms is held as slotted drafts (see handlers.forms).
+"""
+import asyncio
+import heapq
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import db
+from config import FSM_FLUSH_INTERVAL, FSM_MAX_ENTRIES, SESSION_TIMEOUT
+from handlers.forms import FormDraft, compact_data, decode_data, encode_data, expand_data
+
+logger = logging.getLogger(__name__)
+
+
+class _Record:
+    """Cached state and data of one FSM key."""
+
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: Optional[str] = None, data: FormDraft | Dict[str, Any] | None = None):
+        self.state = state
+        self.data = data if data is not None else {}
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _key_str(key: StorageKey) -> str:
+    """Flatten a StorageKey into the fsm_storage primary key."""
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    return ":".join("" if part is None else str(part) for part in parts)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Write-behind FSM storage backed by the fsm_storage table.
+
+    Changes are acknowledged as soon as the cache is updated; a flush
+    scheduled `flush_interval` seconds after the first change writes every
+    dirty key in one group-committed transaction. A cleared key (no state,
+    no data) is deleted from the table. close() flushes what is left, so a
+    graceful restart loses nothing.
+
+    Expiry: `_expiry` holds the keys that have a state or data, ordered by
+    their last change. With one TTL for all keys the oldest entry is always
+    first, so expiring is popping from the front - O(1) amortized, done on
+    every access. A key loaded from disk keeps its older updated_at, which
+    does not fit that order, so it is also pushed on the `_reloaded` heap
+    and expired from there. Keys that are only on disk are checked against
+    their updated_at when loaded and purged by purge_expired().
+
+    Eviction: `_records` is ordered by last access; beyond `max_entries`
+    the least recently used key is dropped from memory only (a dirty one is
+    held until the next flush writes it).
+    """
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TIMEOUT,
+        max_entries: int = FSM_MAX_ENTRIES,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._records: OrderedDict[str, _Record] = OrderedDict()
+        # key -> time of last change, oldest first (only non-empty records)
+        self._expiry: OrderedDict[str, float] = OrderedDict()
+        # (updated_at, key) of keys loaded from disk, oldest first; stale once the key changes
+        self._reloaded: List[Tuple[float, str]] = []
+        # Dirty records evicted from _records before they were flushed
+        self._unflushed: Dict[str, _Record] = {}
+        # Evicted records the running flush is writing
+        self._flushing: Dict[str, _Record] = {}
+        self._dirty: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Cache size and eviction counters (for the health endpoint)."""
+        return {
+            "size": len(self._records),
+            "active_forms": len(self._expiry),
+            "max_entries": self.max_entries,
+            "dirty": len(self._dirty),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _expire_key(self, k: str) -> None:
+        """Drop an expired key from memory and queue its deletion from the table."""
+        self._expiry.pop(k, None)
+        self._records.pop(k, None)
+        self._unflushed[k] = _Record()
+        self._dirty.add(k)
+        self._schedule_flush()
+        self.expirations += 1
+
+    def _expire(self, now: float) -> None:
+        """Expire keys whose last change is older than the TTL (oldest first)."""
+        deadline = now - self.ttl
+        while self._expiry:
+            k, changed_at = next(iter(self._expiry.items()))
+            if changed_at > deadline:
+                break
+            self._expire_key(k)
+        while self._reloaded and self._reloaded[0][0] <= deadline:
+            changed_at, k = heapq.heappop(self._reloaded)
+            if self._expiry.get(k) == changed_at:
+                self._expire_key(k)
+
+    def _evict(self) -> None:
+        """Drop least recently used keys from memory beyond max_entries."""
+        while len(self._records) > self.max_entries:
+            k, record = self._records.popitem(last=False)
+            self._expiry.pop(k, None)
+            if k in self._dirty:
+                self._unflushed[k] = record
+            self.evictions += 1
+
+    def _take_unflushed(self, k: str) -> Optional[_Record]:
+        """An evicted record not yet in the table (waiting for or in a flush): newer than its row."""
+        record = self._unflushed.pop(k, None)
+        return record if record is not None else self._flushing.get(k)
+
+    async def _get(self, key: StorageKey) -> _Record:
+        """Return the cached record for a key, loading it from the database on a miss."""
+        k = _key_str(key)
+        now = time.time()
+        self._expire(now)
+        record = self._records.get(k)
+        if record is not None:
+            self._records.move_to_end(k)
+            return record
+
+        row = None
+        record = self._take_unflushed(k)
+        if record is None:
+            row = await db.load_fsm_record_async(k)
+            # Another handler may have filled the slot while we were reading
+            cached = self._records.get(k)
+            if cached is not None:
+                self._records.move_to_end(k)
+                return cached
+            # ...or filled and evicted it again, in which case the row is stale
+            record = self._take_unflushed(k)
+        if record is not None:
+            if not record.is_empty():
+                self._expiry[k] = now
+        elif row is None:
+            record = _Record()
+        elif row[2] <= now - self.ttl:
+            record = _Record()
+            self._dirty.add(k)
+            self._schedule_flush()
+            self.expirations += 1
+        else:
+            record = _Record(row[0], decode_data(row[1]))
+            self._expiry[k] = row[2]
+            heapq.heappush(self._reloaded, (row[2], k))
+        self._records[k] = record
+        self._evict()
+        return record
+
+    def _mark_dirty(self, key: StorageKey, record: _Record) -> None:
+        """Record a change: refresh the key's TTL and queue it for the next flush."""
+        k = _key_str(key)
+        if record.is_empty():
+            self._expiry.pop(k, None)
+        else:
+            self._expiry[k] = time.time()
+            self._expiry.move_to_end(k)
+        self._dirty.add(k)
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        """Make sure a flush is scheduled."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_later(), name="fsm-storage-flush"
+            )
+
+    async def _flush_later(self) -> None:
+        """Flush after `flush_interval`, again while keys keep changing or a write fails."""
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write all dirty keys to the database in one batch."""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        unflushed, self._unflushed = self._unflushed, {}
+        self._flushing = unflushed
+        batch = []
+        for k in keys:
+            record = self._records.get(k) or unflushed.get(k)
+            if record is None:
+                continue
+            if record.is_empty():
+                batch.append((k, None, None))
+            else:
+                batch.append((k, record.state, encode_data(record.data)))
+        try:
+            await db.write_fsm_records_async(batch)
+        except Exception as e:
+            logger.exception(f"Error flushing {len(batch)} FSM records: {e}")
+            # Retry on the next flush; records already hold the latest values
+            self._dirty |= keys
+            for k, record in unflushed.items():
+                self._unflushed.setdefault(k, record)
+        finally:
+            self._flushing = {}
+
+    async def purge_expired(self) -> int:
+        """Delete expired forms that are only on disk (e.g. left over from before a restart)."""
+        return await db.purge_fsm_records_async(int(time.time() - self.ttl))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        record.data = compact_data(record.state, data)
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return expand_data((await self._get(key)).data)
+
+    async def close(self) -> None:
+        """Cancel the pending flush timer and write everything still dirty."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.flush()
@@ -2,57 +2,143 @@
 Admin handlers - HR management and support reply
 """
 import logging
-import os
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandObject
-from aiogram.types import Message, FSInputFile
-
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    BufferedInputFile,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+)
+
+from broadcast import broadcaster
 from config import ADMIN_ID, SUPPORT_GROUP_ID, is_admin, ADMIN_IDS
-from db import get_last_applicants, get_all_applicants, get_support_tickets, export_support_tickets_to_excel
-import openpyxl
+from db import (
+    Page,
+    export_file_name,
+    get_applicants_page_async,
+    get_support_tickets_page_async,
+)
+from exports import run_export, export_cache, get_export_version
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
+APPLICANTS_PAGE_SIZE = 5
+TICKETS_PAGE_SIZE = 10
+# Download name prefix per export kind (see db.export_file_name)
+EXPORT_FILE_PREFIXES = {"applicants": "arizalar", "support_tickets": "support_tickets"}
+
 
-async def export_to_excel_file(vacancy: str | None = None) -> str | None:
-    """Export applicants to Excel file. Returns file path or None."""
-    rows = get_all_applicants(vacancy)
-    if not rows:
+def page_keyboard(prefix: str, page: Page, filter_value: str | None) -> InlineKeyboardMarkup | None:
+    """
+    Build "◀ / ▶" navigation for a keyset page.
+    ◀ goes to newer rows, ▶ to older ones; callback data carries the id cursor.
+    """
+    buttons = []
+    if page.has_newer:
+        buttons.append(InlineKeyboardButton(
+            text="◀", callback_data=f"{prefix}:n:{page.rows[0]['id']}:{filter_value or ''}"
+        ))
+    if page.has_older:
+        buttons.append(InlineKeyboardButton(
+            text="▶", callback_data=f"{prefix}:o:{page.rows[-1]['id']}:{filter_value or ''}"
+        ))
+    # Telegram limits callback data to 64 bytes; a very long filter can't be paged
+    if not buttons or any(len(b.callback_data.encode()) > 64 for b in buttons):
         return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+def parse_page_callback(data: str) -> tuple[int | None, int | None, str | None]:
+    """Parse '<prefix>:<o|n>:<id>:<filter>' into (before_id, after_id, filter)."""
+    _, direction, cursor, filter_value = data.split(":", 3)
+    cursor_id = int(cursor)
+    if direction == "n":
+        return None, cursor_id, filter_value or None
+    return cursor_id, None, filter_value or None
+
+
+def format_applicants(rows, vacancy: str | None = None) -> str:
+    """Render a page of applicants."""
+    text = "📋 Oxirgi arizalar"
+    if vacancy:
+        text += f" ({vacancy})"
+    text += ":\n\n"
+    for r in rows:
+        text += (
+            f"👤 {r['name']} | 📞 {r['phone']} | 🏢 {r['vacancy']} | 📚 {r['subject']} | "
+            f"💼 {r['experience']} | 🏭 {r['workplace']}\n\n"
+        )
+    return text
+
+
+def format_tickets(rows, category: str | None = None) -> str:
+    """Render a page of support tickets."""
+    title = "📨 Oxirgi support so'rovlar"
+    if category:
+        title += f" ({category})"
+    text = title + ":\n\n"
+    for ticket in rows:
+        ticket_id, user_id, username, phone, cat, question, voice_id, created_at = ticket
+        text += (
+            f"🎫 Ticket #{ticket_id}\n"
+            f"👤 User: @{username or 'N/A'} (ID: {user_id})\n"
+            f"📂 Kategoriya: {cat}\n"
+            f"📞 Telefon: {phone or 'korsatilmagan'}\n"
+            f"❓ Savol: {(question or 'Ovozli xabar').strip()[:80]}...\n"
+            f"⏰ {created_at}\n\n"
+        )
+    return text
+
 
-    file_name = f"{vacancy}_arizalar.xlsx" if vacancy else "all_arizalar.xlsx"
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Arizalar"
-
-    headers = [
-        "ID",
-        "Ism",
-        "Yosh",
-        "Telefon",
-        "Vakansiya",
-        "Yo'nalish",
-        "Tajriba",
-        "Ish joyi",
-        "Username",
-        "Rasm",
-        "CV",
-        "Sana",
-    ]
-    ws.append(headers)
-    for row in rows:
-        # Convert sqlite3.Row to tuple/list
-        if hasattr(row, 'keys'):
-            # It's a Row object, convert to list
-            row_data = [row[i] for i in range(len(row))]
-        else:
-            # It's already a tuple/list
-            row_data = list(row)
-        ws.append(row_data)
-    wb.save(file_name)
-    return file_name
+async def edit_page(callback: CallbackQuery, text: str, markup: InlineKeyboardMarkup | None) -> None:
+    """Replace the admin listing message in place."""
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except TelegramBadRequest as e:
+        # "message is not modified" when the same page is requested twice
+        logger.debug(f"Could not edit page: {e}")
+    await callback.answer()
+
+
+async def send_export(message: Message, kind: str, filter_value: str | None, empty_text: str) -> None:
+    """
+    Build an export in the process pool and send it to the admin.
+    A status message shows the progress and is removed once the file is sent.
+    If the table has not changed since the same export was last sent, the
+    previous Telegram file_id is re-sent without generating anything.
+    """
+    version = await get_export_version(kind)
+    cached_file_id = export_cache.get(kind, filter_value, version)
+    if cached_file_id:
+        try:
+            await message.answer_document(cached_file_id)
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Cached export file_id rejected, regenerating: {e}")
+            export_cache.discard(kind, filter_value)
+
+    status = await message.answer("⏳ Export tayyorlanmoqda...")
+
+    async def on_progress(percent: int) -> None:
+        await status.edit_text(f"⏳ Export tayyorlanmoqda: {percent}%")
+
+    try:
+        content = await run_export(kind, filter_value, on_progress)
+        if not content:
+            await status.edit_text(empty_text)
+            return
+        document = BufferedInputFile(content, filename=export_file_name(EXPORT_FILE_PREFIXES[kind], filter_value))
+        sent = await message.answer_document(document)
+        export_cache.put(kind, filter_value, version, sent.document.file_id)
+        await status.delete()
+    except Exception as e:
+        logger.exception(f"Error sending export file: {e}")
+        await message.answer(f"❌ Faylni yuborishda xatolik: {e}")
 
 
 @router.message(Command("last"))
@@ -63,19 +149,32 @@ async def cmd_last(message: Message, command: CommandObject):
     vacancy = None
     if command.args:
         vacancy = command.args.strip().capitalize()
-    rows = get_last_applicants(limit=5, vacancy=vacancy)
-    if not rows:
+    page = await get_applicants_page_async(limit=APPLICANTS_PAGE_SIZE, vacancy=vacancy)
+    if not page.rows:
         await message.answer(f"{vacancy or 'Umumiy'} bo'yicha ariza topilmadi.")
         return
-    text = "📋 Oxirgi arizalar"
-    if vacancy:
-        text += f" ({vacancy})"
-    text += ":\n\n"
-    for r in rows:
-        text += (
-            f"👤 {r[0]} | 📞 {r[1]} | 🏢 {r[2]} | 📚 {r[3]} | 💼 {r[4]} | 🏭 {r[5]}\n\n"
-        )
-    await message.answer(text)
+    await message.answer(
+        format_applicants(page.rows, vacancy),
+        reply_markup=page_keyboard("adm_last", page, vacancy),
+    )
+
+
+@router.callback_query(F.data.startswith("adm_last:"))
+async def applicants_page(callback: CallbackQuery):
+    """Handle ◀ / ▶ navigation of the applicants listing."""
+    if not is_admin(callback.message.chat.id):
+        await callback.answer()
+        return
+    before_id, after_id, vacancy = parse_page_callback(callback.data)
+    page = await get_applicants_page_async(
+        before_id=before_id, after_id=after_id, limit=APPLICANTS_PAGE_SIZE, vacancy=vacancy
+    )
+    if not page.rows:
+        await callback.answer("Boshqa arizalar yo'q.")
+        return
+    await edit_page(
+        callback, format_applicants(page.rows, vacancy), page_keyboard("adm_last", page, vacancy)
+    )
 
 
 @router.message(Command("export"))
@@ -86,24 +185,7 @@ async def cmd_export(message: Message, command: CommandObject):
     vacancy = None
     if command.args:
         vacancy = command.args.strip().capitalize()
-    file_name = await export_to_excel_file(vacancy)
-    if not file_name:
-        await message.answer(f"{vacancy or 'Umumiy'} bo'yicha ariza topilmadi.")
-        return
-    file = None
-    try:
-        file = FSInputFile(file_name)
-        await message.answer_document(file)
-    except Exception as e:
-        logger.exception(f"Error sending export file: {e}")
-        await message.answer(f"❌ Faylni yuborishda xatolik: {e}")
-    finally:
-        # Always cleanup file
-        if file_name and os.path.exists(file_name):
-            try:
-                os.remove(file_name)
-            except Exception as e:
-                logger.warning(f"Could not remove file {file_name}: {e}")
+    await send_export(message, "applicants", vacancy, f"{vacancy or 'Umumiy'} bo'yicha ariza topilmadi.")
 
 
 @router.message(F.text == "📋 Oxirgi arizalar")
@@ -111,16 +193,13 @@ async def last_button(message: Message):
     """Handle 'Last applications' button for admin."""
     if not is_admin(message.chat.id):
         return
-    rows = get_last_applicants(limit=5)
-    if not rows:
+    page = await get_applicants_page_async(limit=APPLICANTS_PAGE_SIZE)
+    if not page.rows:
         await message.answer("Arizalar topilmadi.")
         return
-    text = "📋 Oxirgi arizalar:\n\n"
-    for r in rows:
-        text += (
-            f"👤 {r[0]} | 📞 {r[1]} | 🏢 {r[2]} | 📚 {r[3]} | 💼 {r[4]} | 🏭 {r[5]}\n\n"
-        )
-    await message.answer(text)
+    await message.answer(
+        format_applicants(page.rows), reply_markup=page_keyboard("adm_last", page, None)
+    )
 
 
 @router.message(F.text == "📤 Export")
@@ -128,24 +207,7 @@ async def export_button(message: Message):
     """Handle 'Export' button for admin."""
     if not is_admin(message.chat.id):
         return
-    file_name = await export_to_excel_file()
-    if not file_name:
-        await message.answer("Arizalar topilmadi.")
-        return
-    file = None
-    try:
-        file = FSInputFile(file_name)
-        await message.answer_document(file)
-    except Exception as e:
-        logger.exception(f"Error sending export file: {e}")
-        await message.answer(f"❌ Faylni yuborishda xatolik: {e}")
-    finally:
-        # Always cleanup file
-        if file_name and os.path.exists(file_name):
-            try:
-                os.remove(file_name)
-            except Exception as e:
-                logger.warning(f"Could not remove file {file_name}: {e}")
+    await send_export(message, "applicants", None, "Arizalar topilmadi.")
 
 
 @router.message(F.text == "📨 Support murojaatlar")
@@ -155,23 +217,13 @@ async def support_tickets_button(message: Message):
         return
     
     try:
-        tickets = get_support_tickets(limit=10)
-        if not tickets:
+        page = await get_support_tickets_page_async(limit=TICKETS_PAGE_SIZE)
+        if not page.rows:
             await message.answer("📨 Support so'rovlar topilmadi.")
             return
-
-        text = "📨 Oxirgi support so'rovlar:\n\n"
-        for ticket in tickets:
-            ticket_id, user_id, username, phone, cat, question, voice_id, created_at = ticket
-            text += (
-                f"🎫 Ticket #{ticket_id}\n"
-                f"👤 User: @{username or 'N/A'} (ID: {user_id})\n"
-                f"📂 Kategoriya: {cat}\n"
-                f"📞 Telefon: {phone or 'korsatilmagan'}\n"
-                f"❓ Savol: {(question or 'Ovozli xabar').strip()[:80]}...\n"
-                f"⏰ {created_at}\n\n"
-            )
-        await message.answer(text)
+        await message.answer(
+            format_tickets(page.rows), reply_markup=page_keyboard("adm_sup", page, None)
+        )
     except Exception as e:
         logger.exception(f"Error getting support tickets: {e}")
         await message.answer("❌ Xatolik: Support so'rovlarni olishda muammo.")
@@ -182,26 +234,7 @@ async def export_support_button(message: Message):
     """Handle 'Export Support' button for admin."""
     if not is_admin(message.chat.id):
         return
-
-    file_name = export_support_tickets_to_excel()
-    if not file_name:
-        await message.answer("Support so'rovlar topilmadi.")
-        return
-
-    file = None
-    try:
-        file = FSInputFile(file_name)
-        await message.answer_document(file)
-    except Exception as e:
-        logger.exception(f"Error sending export file: {e}")
-        await message.answer(f"❌ Faylni yuborishda xatolik: {e}")
-    finally:
-        # Always cleanup file
-        if file_name and os.path.exists(file_name):
-            try:
-                os.remove(file_name)
-            except Exception as e:
-                logger.warning(f"Could not remove file {file_name}: {e}")
+    await send_export(message, "support_tickets", None, "Support so'rovlar topilmadi.")
 
 
 @router.message(Command("answer"))
@@ -273,32 +306,42 @@ async def cmd_support_tickets(message: Message, command: CommandObject):
         category = command.args.strip()
 
     try:
-        tickets = get_support_tickets(limit=10, category=category)
-        if not tickets:
+        page = await get_support_tickets_page_async(limit=TICKETS_PAGE_SIZE, category=category)
+        if not page.rows:
             await message.answer(f"📨 Support so'rovlar topilmadi{f' ({category})' if category else ''}.")
             return
-
-        title = "📨 Oxirgi support so'rovlar"
-        if category:
-            title += f" ({category})"
-        text = title + ":\n\n"
-
-        for ticket in tickets:
-            ticket_id, user_id, username, phone, cat, question, voice_id, created_at = ticket
-            text += (
-                f"🎫 Ticket #{ticket_id}\n"
-                f"👤 User: @{username or 'N/A'} (ID: {user_id})\n"
-                f"📂 Kategoriya: {cat}\n"
-                f"📞 Telefon: {phone or 'korsatilmagan'}\n"
-                f"❓ Savol: {(question or 'Ovozli xabar').strip()[:80]}...\n"
-                f"⏰ {created_at}\n\n"
-            )
-        await message.answer(text)
+        await message.answer(
+            format_tickets(page.rows, category),
+            reply_markup=page_keyboard("adm_sup", page, category),
+        )
     except Exception as e:
         logger.exception(f"Error getting support tickets: {e}")
         await message.answer("❌ Xatolik: Support so'rovlarni olishda muammo.")
 
 
+@router.callback_query(F.data.startswith("adm_sup:"))
+async def support_tickets_page(callback: CallbackQuery):
+    """Handle ◀ / ▶ navigation of the support tickets listing."""
+    if not is_admin(callback.message.chat.id):
+        await callback.answer()
+        return
+    before_id, after_id, category = parse_page_callback(callback.data)
+    try:
+        page = await get_support_tickets_page_async(
+            before_id=before_id, after_id=after_id, limit=TICKETS_PAGE_SIZE, category=category
+        )
+    except Exception as e:
+        logger.exception(f"Error getting support tickets: {e}")
+        await callback.answer("❌ Xatolik", show_alert=True)
+        return
+    if not page.rows:
+        await callback.answer("Boshqa so'rovlar yo'q.")
+        return
+    await edit_page(
+        callback, format_tickets(page.rows, category), page_keyboard("adm_sup", page, category)
+    )
+
+
 @router.message(Command("export_support"))
 async def cmd_export_support(message: Message, command: CommandObject):
     """
@@ -312,22 +355,48 @@ async def cmd_export_support(message: Message, command: CommandObject):
     if command.args:
         category = command.args.strip()
 
-    file_name = export_support_tickets_to_excel(category)
-    if not file_name:
-        await message.answer(f"{category or 'Umumiy'} bo'yicha support so'rovlar topilmadi.")
+    await send_export(
+        message, "support_tickets", category, f"{category or 'Umumiy'} bo'yicha support so'rovlar topilmadi."
+    )
+
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, command: CommandObject):
+    """
+    Send an announcement (HTML) to every known user.
+    Usage: /broadcast <matn>
+    """
+    if not is_admin(message.chat.id):
+        return
+    if not command.args:
+        await message.answer("Foydalanish: /broadcast <matn>")
+        return
+    if broadcaster.running:
+        await message.answer("⏳ Boshqa broadcast davom etmoqda. To'xtatish: /broadcast_stop")
         return
 
-    file = None
+    # Preview to the admin first: invalid HTML fails here, not on every recipient
     try:
-        file = FSInputFile(file_name)
-        await message.answer_document(file)
-    except Exception as e:
-        logger.exception(f"Error sending export file: {e}")
-        await message.answer(f"❌ Faylni yuborishda xatolik: {e}")
-    finally:
-        # Always cleanup file
-        if file_name and os.path.exists(file_name):
-            try:
-                os.remove(file_name)
-            except Exception as e:
-                logger.warning(f"Could not remove file {file_name}: {e}")
+        await message.answer(command.args)
+    except TelegramBadRequest as e:
+        await message.answer(f"❌ Xabar matnida xato: {e}")
+        return
+
+    status = await message.answer("📣 Broadcast boshlanmoqda...")
+    try:
+        broadcast_id = await broadcaster.start(message.bot, command.args, message.from_user.id, status)
+    except RuntimeError:
+        await status.edit_text("⏳ Boshqa broadcast davom etmoqda. To'xtatish: /broadcast_stop")
+        return
+    logger.info(f"Broadcast #{broadcast_id} started by {message.from_user.id}")
+
+
+@router.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: Message):
+    """Stop the running broadcast."""
+    if not is_admin(message.chat.id):
+        return
+    if broadcaster.cancel():
+        await message.answer("⏹ Broadcast to'xtatilmoqda...")
+    else:
+        await message.answer("Hozir broadcast yo'q.")
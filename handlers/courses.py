@@ -13,7 +13,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
 from config import GROUP_ID
-from db import save_course_lead
+from db import Notification, save_course_lead_async
+from outbox import outbox_worker
 from handlers.utils import validate_phone
 
 logger = logging.getLogger(__name__)
@@ -314,6 +315,21 @@ class CoursesForm(StatesGroup):
     asking_phone = State()
 
 
+def lead_notification(username: str | None, user_id: int, course_name: str, tariff: str, phone: str) -> Notification:
+    """
+    New lead notification for the group, saved to the outbox together with
+    the lead (see outbox.OutboxWorker).
+    """
+    lead_text = (
+        f"📞 <b>Yangi kurs lead</b>\n\n"
+        f"👤 User: @{username or 'N/A'} (ID: {user_id})\n"
+        f"📚 Kurs: {course_name}\n"
+        f"📋 Tarif: {tariff}\n"
+        f"📞 Telefon: {phone}"
+    )
+    return Notification("course_lead", [GROUP_ID], lambda lead_id: [{"method": "send_message", "text": lead_text}])
+
+
 @router.callback_query(F.data == "menu_courses")
 async def start_courses(callback: CallbackQuery, state: FSMContext):
     """Start courses info flow from main menu."""
@@ -425,15 +441,21 @@ async def process_course_phone_contact(message: Message, state: FSMContext):
         data = await state.get_data()
         
         try:
-            from db import save_course_lead
-            lead_id = save_course_lead({
-                "user_id": message.from_user.id,
-                "username": message.from_user.username,
-                "course_name": data.get("course_name"),
-                "tariff": data.get("tariff"),
-                "phone": phone,
-            })
+            lead_id = await save_course_lead_async(
+                {
+                    "user_id": message.from_user.id,
+                    "username": message.from_user.username,
+                    "course_name": data.get("course_name"),
+                    "tariff": data.get("tariff"),
+                    "phone": phone,
+                },
+                lead_notification(
+                    message.from_user.username, message.from_user.id,
+                    data.get("course_name"), data.get("tariff"), phone,
+                ),
+            )
             logger.info(f"Course lead saved with id {lead_id}")
+            outbox_worker.wake()
             
             # Bosh menyu tugmasi
             from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
@@ -483,26 +505,23 @@ async def process_course_phone(message: Message, state: FSMContext):
     phone = message.text.strip()
     
     try:
-        lead_id = save_course_lead({
-            "user_id": message.from_user.id,
-            "username": message.from_user.username,
-            "course_name": data.get("course_name"),
-            "tariff": data.get("tariff"),
-            "phone": phone,
-        })
-        
-        logger.info(f"Course lead saved with id {lead_id}")
-        
-        # Send to group
-        lead_text = (
-            f"📞 <b>Yangi kurs lead</b>\n\n"
-            f"👤 User: @{message.from_user.username or 'N/A'} (ID: {message.from_user.id})\n"
-            f"📚 Kurs: {data.get('course_name')}\n"
-            f"📋 Tarif: {data.get('tariff')}\n"
-            f"📞 Telefon: {phone}"
+        lead_id = await save_course_lead_async(
+            {
+                "user_id": message.from_user.id,
+                "username": message.from_user.username,
+                "course_name": data.get("course_name"),
+                "tariff": data.get("tariff"),
+                "phone": phone,
+            },
+            # Sent to the group by the outbox worker
+            lead_notification(
+                message.from_user.username, message.from_user.id,
+                data.get("course_name"), data.get("tariff"), phone,
+            ),
         )
         
-        await message.bot.send_message(chat_id=GROUP_ID, text=lead_text)
+        logger.info(f"Course lead saved with id {lead_id}")
+        outbox_worker.wake()
         
         # Bosh menyu tugmasi
         from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
@@ -0,0 +1,119 @@
+"""
+Typed form drafts held in FSM data.
+
+Handlers keep using state.update_data()/get_data() with plain dicts; the FSM
+storage converts the data of a known form (by the state group prefix, e.g.
+"HRForm:writing_age") into one of these __slots__ records, which is several
+times smaller than a dict, and stores it as a compact JSON list.
+"""
+import json
+from typing import Any, Dict, Tuple
+
+
+class FormDraft:
+    """Base for form drafts: a fixed set of fields, None means "not filled in yet"."""
+
+    __slots__ = ()
+    # StatesGroup name the draft belongs to, and its fields in storage order
+    GROUP: str = ""
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init__(self, **values: Any):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, name) is not None for name in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    @classmethod
+    def accepts(cls, data: Dict[str, Any]) -> bool:
+        """True if every key of data is a field of this draft."""
+        return all(key in cls.FIELDS for key in data)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FormDraft":
+        return cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """FSM data dict with the filled-in fields only."""
+        values = ((name, getattr(self, name)) for name in self.FIELDS)
+        return {name: value for name, value in values if value is not None}
+
+    def pack(self) -> list:
+        """Field values in FIELDS order, without trailing empty fields."""
+        values = [getattr(self, name) for name in self.FIELDS]
+        while values and values[-1] is None:
+            values.pop()
+        return values
+
+    @classmethod
+    def unpack(cls, values: list) -> "FormDraft":
+        return cls(**dict(zip(cls.FIELDS, values)))
+
+
+class ApplicationDraft(FormDraft):
+    """HRForm: job application."""
+
+    GROUP = "HRForm"
+    FIELDS = (
+        "vacancy", "subject", "name", "username", "age", "phone",
+        "experience", "workplace", "photo_id", "cv_file_id",
+    )
+    __slots__ = FIELDS
+
+
+class SupportTicketDraft(FormDraft):
+    """SupportForm: support question."""
+
+    GROUP = "SupportForm"
+    FIELDS = ("category", "category_key", "question", "question_voice_id", "phone")
+    __slots__ = FIELDS
+
+
+class CourseLeadDraft(FormDraft):
+    """CoursesForm: course lead."""
+
+    GROUP = "CoursesForm"
+    FIELDS = ("course_name", "tariff")
+    __slots__ = FIELDS
+
+
+DRAFTS: Dict[str, type] = {
+    draft.GROUP: draft for draft in (ApplicationDraft, SupportTicketDraft, CourseLeadDraft)
+}
+
+
+def compact_data(state: str | None, data: Dict[str, Any]) -> FormDraft | Dict[str, Any]:
+    """
+    Return data as a draft if the state belongs to a known form and every key
+    is one of its fields; otherwise a copy of the dict.
+    """
+    draft = DRAFTS.get(state.split(":", 1)[0]) if state else None
+    if draft is None or not data or not draft.accepts(data):
+        return dict(data)
+    return draft.from_dict(data)
+
+
+def expand_data(data: FormDraft | Dict[str, Any]) -> Dict[str, Any]:
+    """FSM data dict for a draft or a stored dict (always a new dict)."""
+    if isinstance(data, FormDraft):
+        return data.to_dict()
+    return data.copy()
+
+
+def encode_data(data: FormDraft | Dict[str, Any]) -> str:
+    """JSON for storage: ["HRForm", value, ...] for a draft, an object otherwise."""
+    if isinstance(data, FormDraft):
+        return json.dumps([data.GROUP, *data.pack()], ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_data(raw: str) -> FormDraft | Dict[str, Any]:
+    """Inverse of encode_data()."""
+    value = json.loads(raw)
+    if isinstance(value, list):
+        return DRAFTS[value[0]].unpack(value[1:])
+    return value
@@ -16,7 +16,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
 from config import ADMIN_ID, GROUP_ID, ADMIN_IDS
-from db import save_application
+from db import Notification, save_application_async
+from outbox import outbox_worker
 from handlers.utils import validate_phone, validate_age, validate_name
 
 logger = logging.getLogger(__name__)
@@ -26,6 +27,8 @@ router = Router()
 # Constants
 VACANCIES = ["Sotuvchi", "Admin", "Mentor", "Support"]
 MENTOR_SUBJECTS = ["SMM", "Mobilografiya", "Dasturlash"]
+# Telegram's caption length limit (checked on the HTML source, which is never shorter)
+CAPTION_LIMIT = 1024
 
 
 # FSM States for HR
@@ -56,8 +59,11 @@ def escape_html(text: str | None) -> str:
     )
 
 
-async def send_application_to_admin(bot, data: dict) -> None:
-    """Send application notification to admin and group."""
+def application_notification(data: dict) -> Notification:
+    """
+    Application notification for the admins and the group, saved to the
+    outbox together with the application (see outbox.OutboxWorker).
+    """
     # Escape HTML to prevent injection
     name = escape_html(data.get('name'))
     age = escape_html(data.get('age'))
@@ -85,15 +91,24 @@ async def send_application_to_admin(bot, data: dict) -> None:
 
     text += f"🔗 Username: @{username if username else 'N/A'}"
 
-    for chat in ADMIN_IDS + [GROUP_ID]:
-        try:
-            await bot.send_message(chat_id=chat, text=text)
-            if data.get("photo_id"):
-                await bot.send_photo(chat_id=chat, photo=data["photo_id"])
-            if data.get("cv_file_id"):
-                await bot.send_document(chat_id=chat, document=data["cv_file_id"])
-        except Exception as e:
-            logger.exception(f"Error sending application to {chat}: {e}")
+    # The text rides as the caption of the photo (or of the CV when there is
+    # no photo), so a recipient gets 1-2 calls instead of 3. A media group
+    # cannot mix a photo with a document, so the CV stays a separate send.
+    # If the file is rejected, the outbox sends the caption as a plain message
+    # and goes on with the CV.
+    photo_id, cv_file_id = data.get("photo_id"), data.get("cv_file_id")
+    attachments = []
+    if photo_id:
+        attachments.append({"method": "send_photo", "photo": photo_id})
+    if cv_file_id:
+        attachments.append({"method": "send_document", "document": cv_file_id})
+    if attachments and len(text) <= CAPTION_LIMIT:
+        attachments[0]["caption"] = text
+        steps = attachments
+    else:
+        steps = [{"method": "send_message", "text": text}] + attachments
+
+    return Notification("application", ADMIN_IDS + [GROUP_ID], lambda app_id: steps)
 
 
 @router.message(Command("hr_start"))
@@ -352,9 +367,10 @@ async def finish_application(message: Message, state: FSMContext):
     )
     
     try:
-        app_id = save_application(data)
+        data["user_id"] = message.from_user.id  # broadcast recipient
+        app_id = await save_application_async(data, application_notification(data))
         logger.info(f"Application saved with id {app_id}")
-        await send_application_to_admin(message.bot, data)
+        outbox_worker.wake()
         await message.answer(
             "✅ Rahmat! Arizangiz qabul qilindi. Tez orada siz bilan bog'lanamiz.",
             reply_markup=main_menu_kb
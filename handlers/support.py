@@ -15,7 +15,8 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
 from config import SUPPORT_GROUP_ID
-from db import save_support_ticket
+from db import Notification, save_support_ticket_async
+from outbox import outbox_worker
 from handlers.utils import validate_phone
 
 logger = logging.getLogger(__name__)
@@ -67,11 +68,14 @@ def escape_html(text: str | None) -> str:
     )
 
 
-async def send_ticket_to_support_group(
-    bot, ticket_id: int, user_id: int, username: str, category: str, question: str, 
+def ticket_notification(
+    user_id: int, username: str, category: str, question: str,
     voice_id: str | None = None, phone: str | None = None
-):
-    """Send support ticket to support group."""
+) -> Notification:
+    """
+    Support ticket notification for the support group, saved to the outbox
+    together with the ticket (see outbox.OutboxWorker).
+    """
     is_night = not is_working_hours()
     night_label = "[Night queue] " if is_night else ""
     
@@ -81,28 +85,29 @@ async def send_ticket_to_support_group(
     safe_category = escape_html(category)
     safe_question = escape_html(question)
     
-    text = (
-        f"{night_label}🎫 <b>Support Ticket #{ticket_id}</b>\n\n"
-        f"👤 User: @{safe_username or 'N/A'} (ID: {user_id})\n"
-        f"📂 Kategoriya: {safe_category}\n"
-    )
-    
-    if phone:
-        text += f"📞 Telefon: {safe_phone}\n"
-    else:
-        text += "📞 Telefon: ko'rsatilmagan\n"
-    
-    text += f"\n❓ Savol:\n{safe_question}"
-    
-    if voice_id:
-        text += f"\n\n🎤 Ovozli xabar mavjud (file_id: {voice_id})"
-    
-    try:
-        await bot.send_message(chat_id=SUPPORT_GROUP_ID, text=text)
+    def render(ticket_id: int) -> list[dict]:
+        text = (
+            f"{night_label}🎫 <b>Support Ticket #{ticket_id}</b>\n\n"
+            f"👤 User: @{safe_username or 'N/A'} (ID: {user_id})\n"
+            f"📂 Kategoriya: {safe_category}\n"
+        )
+        
+        if phone:
+            text += f"📞 Telefon: {safe_phone}\n"
+        else:
+            text += "📞 Telefon: ko'rsatilmagan\n"
+        
+        text += f"\n❓ Savol:\n{safe_question}"
+        
         if voice_id:
-            await bot.send_voice(chat_id=SUPPORT_GROUP_ID, voice=voice_id)
-    except Exception as e:
-        logger.exception(f"Error sending ticket to support group: {e}")
+            text += f"\n\n🎤 Ovozli xabar mavjud (file_id: {voice_id})"
+        
+        steps = [{"method": "send_message", "text": text}]
+        if voice_id:
+            steps.append({"method": "send_voice", "voice": voice_id})
+        return steps
+    
+    return Notification("support_ticket", [SUPPORT_GROUP_ID], render)
 
 
 @router.callback_query(F.data == "menu_support")
@@ -267,29 +272,29 @@ async def finish_support_ticket(message: Message, state: FSMContext):
         return
     
     try:
-        ticket_id = save_support_ticket({
-            "user_id": message.from_user.id,
-            "username": message.from_user.username,
-            "phone": data.get("phone"),
-            "category": data.get("category"),
-            "question": data.get("question"),
-            "question_voice_id": data.get("question_voice_id"),
-            "status": "pending",
-        })
+        ticket_id = await save_support_ticket_async(
+            {
+                "user_id": message.from_user.id,
+                "username": message.from_user.username,
+                "phone": data.get("phone"),
+                "category": data.get("category"),
+                "question": data.get("question"),
+                "question_voice_id": data.get("question_voice_id"),
+                "status": "pending",
+            },
+            # Sent to the support group by the outbox worker
+            ticket_notification(
+                user_id=message.from_user.id,
+                username=message.from_user.username,
+                category=data.get("category"),
+                question=data.get("question"),
+                voice_id=data.get("question_voice_id"),
+                phone=data.get("phone"),
+            ),
+        )
         
         logger.info(f"Support ticket saved with id {ticket_id}")
-        
-        # Send to support group
-        await send_ticket_to_support_group(
-            bot=message.bot,
-            ticket_id=ticket_id,
-            user_id=message.from_user.id,
-            username=message.from_user.username,
-            category=data.get("category"),
-            question=data.get("question"),
-            voice_id=data.get("question_voice_id"),
-            phone=data.get("phone"),
-        )
+        outbox_worker.wake()
         
         # Bosh menyu tugmasi
         from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
@@ -0,0 +1,235 @@
+"""
+Helpers for raw Telegram updates (plain dicts as posted to the webhook).
+
+Standard library only, so both bots (the aiogram webhook in webhook.py and
+the telepot/Flask app.py) can inspect an update before any framework
+parses it.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# update_ids remembered in memory
+DEDUP_RING_SIZE = 10_000
+# Telegram gives up redelivering an update after 24 hours
+DEDUP_RETENTION = 24 * 3600
+# Delete expired processed_updates rows once per this many new update_ids
+DEDUP_PURGE_EVERY = 1000
+# Seconds to wait for the database write lock; past that the update is let
+# through (checked in memory only) rather than holding the webhook request
+DEDUP_BUSY_TIMEOUT = 0.05
+
+# Update types whose object carries the chat it belongs to
+CHAT_UPDATE_TYPES = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "business_message",
+    "edited_business_message",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+    "message_reaction",
+    "message_reaction_count",
+    "chat_boost",
+    "removed_chat_boost",
+)
+# Update types that belong to a user but no chat
+USER_UPDATE_TYPES = (
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+)
+
+
+def update_type(update: Dict[str, Any]) -> Optional[str]:
+    """The update's payload key, e.g. "message" or "callback_query"."""
+    for key in update:
+        if key != "update_id":
+            return key
+    return None
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Id of the chat (or, for chat-less updates, the user) an update belongs
+    to: updates with the same id must be handled in order. None for updates
+    that belong to nobody in particular (e.g. poll results).
+    """
+    kind = update_type(update)
+    payload = update.get(kind) if kind else None
+    if not isinstance(payload, dict):
+        return None
+    if kind in CHAT_UPDATE_TYPES:
+        return (payload.get("chat") or {}).get("id")
+    if kind == "callback_query":
+        message = payload.get("message")
+        if message:
+            return (message.get("chat") or {}).get("id")
+        return (payload.get("from") or {}).get("id")
+    if kind in USER_UPDATE_TYPES:
+        return (payload.get("from") or {}).get("id")
+    if kind == "poll_answer":
+        return (payload.get("user") or payload.get("voter_chat") or {}).get("id")
+    return None
+
+
+def update_chat(update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The chat object of an update (for a callback query, of its message), if any."""
+    kind = update_type(update)
+    payload = update.get(kind) if kind else None
+    if not isinstance(payload, dict):
+        return None
+    if kind == "callback_query":
+        payload = payload.get("message") or {}
+    return payload.get("chat")
+
+
+def is_command(update: Dict[str, Any]) -> bool:
+    """True for a message whose text (or caption) is a bot command."""
+    message = update.get("message") or update.get("edited_message") or {}
+    return (message.get("text") or message.get("caption") or "").startswith("/")
+
+
+class UpdateFilter:
+    """
+    Cheap checks on a raw update, done before it is parsed and dispatched.
+
+    - update types without handlers are dropped (normally allowed_updates
+      keeps them away; this covers updates queued under an older setting);
+    - private chats always pass;
+    - in the staff groups (`staff_chat_ids`) only commands and button
+      presses pass, the rest is staff talking among themselves;
+    - other groups and channels are dropped.
+    """
+
+    def __init__(self, allowed_types: Iterable[str], staff_chat_ids: Iterable[int]):
+        self.allowed_types = frozenset(allowed_types)
+        self.staff_chat_ids = frozenset(chat_id for chat_id in staff_chat_ids if chat_id)
+        self.dropped: Dict[str, int] = {"type": 0, "chat": 0}
+
+    def stats(self) -> Dict[str, int]:
+        """Dropped update counts by reason (for the health endpoint)."""
+        return dict(self.dropped)
+
+    def _check(self, update: Dict[str, Any]) -> Optional[str]:
+        kind = update_type(update)
+        if kind not in self.allowed_types:
+            return "type"
+        chat = update_chat(update)
+        if chat is None or chat.get("type") == "private":
+            return None
+        if chat.get("id") in self.staff_chat_ids and (kind == "callback_query" or is_command(update)):
+            return None
+        return "chat"
+
+    def accepts(self, update: Dict[str, Any]) -> bool:
+        """True if the update should be dispatched."""
+        reason = self._check(update)
+        if reason is None:
+            return True
+        self.dropped[reason] += 1
+        return False
+
+
+class UpdateDeduplicator:
+    """
+    Drops updates Telegram delivers again (after a timeout or a 5xx answer)
+    so they are not handled twice.
+
+    The last `size` update_ids are kept in a ring buffer (deque) with a set
+    for O(1) lookups. With `db_path`, accepted update_ids are also written
+    to the processed_updates table (db migration 007), which catches
+    redeliveries that reach another process or arrive after a restart; a
+    busy or locked database never delays an update, it is then treated as
+    new (see DEDUP_BUSY_TIMEOUT). Safe to use from several threads.
+    """
+
+    def __init__(self, size: int = DEDUP_RING_SIZE, db_path: Optional[str] = None):
+        self.size = size
+        self.db_path = db_path
+        self._ring: Deque[int] = deque()
+        self._seen: Set[int] = set()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inserted = 0
+        self.suppressed = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Remembered and suppressed update counts (for the health endpoint)."""
+        return {"remembered": len(self._ring), "suppressed": self.suppressed}
+
+    def _remember(self, update_id: int) -> None:
+        if len(self._ring) >= self.size:
+            self._seen.discard(self._ring.popleft())
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened on first use: the table exists once db.ensure_db() has run
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.db_path, timeout=DEDUP_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.Error:
+                conn.close()
+                raise
+            self._conn = conn
+        return self._conn
+
+    def _claim_in_db(self, update_id: int) -> bool:
+        """Record update_id; False if another process (or a previous run) already did."""
+        now = time.time()
+        conn = self._db()
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)", (update_id, now)
+        ).rowcount
+        self._inserted += 1
+        if self._inserted % DEDUP_PURGE_EVERY == 0:
+            conn.execute("DELETE FROM processed_updates WHERE received_at < ?", (now - DEDUP_RETENTION,))
+        return inserted == 1
+
+    def seen(self, update_id: Optional[int]) -> bool:
+        """
+        True if the update was accepted before (it should be dropped);
+        otherwise remember it and return False.
+        """
+        if update_id is None:
+            return False
+        with self._lock:
+            duplicate = update_id in self._seen
+            if not duplicate and self.db_path:
+                try:
+                    duplicate = not self._claim_in_db(update_id)
+                except sqlite3.Error as e:
+                    # Deduplication must never stop or delay updates (e.g. "database is locked"): memory only
+                    logger.warning(f"Update dedup table unavailable: {e}")
+            if duplicate:
+                self.suppressed += 1
+                return True
+            self._remember(update_id)
+            return False
+
+    def forget(self, update_id: Optional[int]) -> None:
+        """The update was not accepted after all (e.g. queue full): let its redelivery through."""
+        if update_id is None:
+            return
+        with self._lock:
+            if update_id in self._seen:
+                self._seen.discard(update_id)
+                self._ring.remove(update_id)
+            if self.db_path:
+                try:
+                    self._db().execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+                except sqlite3.Error as e:
+                    logger.warning(f"Update dedup table unavailable: {e}")
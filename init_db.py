@@ -1,57 +1,22 @@
 """
 Database initialization script
-Creates the applicants table if it doesn't exist
+Applies pending schema migrations (see db.MIGRATIONS)
 """
-import sqlite3
-from contextlib import contextmanager
-
-
-@contextmanager
-def db_connection():
-    """Database connection context manager."""
-    conn = None
-    try:
-        conn = sqlite3.connect("hr_bot.db", timeout=10)
-        yield conn
-        conn.commit()
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        print(f"❌ Database error: {e}")
-        raise
-    finally:
-        if conn:
-            conn.close()
+from db import ensure_db, get_schema_version, close_pool
 
 
 def init_db():
     """
-    Initialize database and create applicants table.
+    Initialize database and bring the schema up to date.
     """
     try:
-        with db_connection() as conn:
-            c = conn.cursor()
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS applicants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    age TEXT,
-                    phone TEXT,
-                    vacancy TEXT NOT NULL,
-                    subject TEXT,
-                    experience TEXT,
-                    workplace TEXT,
-                    username TEXT,
-                    photo_id TEXT,
-                    cv_file_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-        print("✅ Database muvaffaqiyatli yaratildi!")
+        ensure_db()
+        print(f"✅ Database muvaffaqiyatli yaratildi! (schema v{get_schema_version()})")
     except Exception as e:
         print(f"❌ Xatolik: {e}")
         raise
+    finally:
+        close_pool()
 
 
 if __name__ == "__main__":
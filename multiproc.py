@@ -0,0 +1,277 @@
+"""
+Multi-process serving for the aiogram bot.
+Run with: python multiproc.py (instead of python bot_aiogram.py)
+
+A front process listens on WEBAPP_HOST:WEBAPP_PORT (where the webhook
+points) and starts WORKERS copies of bot_aiogram.py, worker i listening on
+127.0.0.1:WORKER_BASE_PORT+i. Every update is forwarded to the worker
+chosen by its chat id, so one chat always reaches the same process: its
+FSM state stays in that process's cache and its updates keep their order.
+Admin chats go to worker 0, which also runs the jobs that must exist once
+(outbox, broadcasts, FSM purge, webhook registration).
+
+SQLite writers: each process keeps its own db.WriteQueue (one writer thread
+committing writes in batches); SQLite's WAL write lock serializes the
+commits of different processes, which wait for it up to DB_BUSY_TIMEOUT,
+and readers are never blocked. As every commit carries a whole batch,
+workers contend for the lock once per batch, not once per write.
+
+The front does little per update (a JSON parse and one local request; the
+worker answers as soon as the update is queued). A worker that dies is
+restarted with backoff, and SIGHUP restarts the workers one at a time (each
+finishes its queued updates first), e.g. after a deploy. While a worker is
+down its chats get 503 and Telegram redelivers their updates later.
+One socket shared with SO_REUSEPORT was not an option: the kernel spreads
+connections, not chats, across processes.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from config import ADMIN_IDS, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WORKERS, WORKER_BASE_PORT
+from ingress import update_chat_id
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("geeks_bot.front")
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_aiogram.py")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Seconds a worker may take to accept a forwarded update
+FORWARD_TIMEOUT = 5.0
+# Seconds a worker gets to finish its queued updates after SIGTERM
+WORKER_STOP_TIMEOUT = 30.0
+# Seconds to wait for a (re)started worker to accept connections
+WORKER_START_TIMEOUT = 60.0
+# Delay before restarting a crashed worker: doubles per crash in a row, up to this
+RESTART_BACKOFF_MAX = 30.0
+# A worker that ran this long before exiting did not crash "in a row"
+STABLE_AFTER = 60.0
+
+
+def route(update: Dict[str, Any], workers: int) -> int:
+    """Index of the worker that handles an update."""
+    chat_id = update_chat_id(update)
+    if chat_id is None:
+        return hash(update.get("update_id", 0)) % workers
+    if chat_id in ADMIN_IDS:
+        return 0
+    return hash(chat_id) % workers
+
+
+class Worker:
+    """One bot_aiogram.py process and its forwarding counters."""
+
+    def __init__(self, index: int, port: int, command: List[str]):
+        self.index = index
+        self.port = port
+        self.command = command
+        self.process: asyncio.subprocess.Process | None = None
+        self.ready = False
+        self.restart_requested = False
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restarts = 0
+        self.forwarded = 0
+        self.failed = 0
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": self.process.pid if self.process else None,
+            "ready": self.ready,
+            "restarts": self.restarts,
+            "forwarded": self.forwarded,
+            "failed": self.failed,
+        }
+
+
+class Supervisor:
+    """Starts the workers, restarts them when they exit and forwards updates to them."""
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        base_port: int = WORKER_BASE_PORT,
+        command: List[str] | None = None,
+        path: str = WEBHOOK_PATH,
+    ):
+        command = command or [sys.executable, BOT_SCRIPT]
+        self.workers = [Worker(i, base_port + i, command) for i in range(max(1, workers))]
+        self.path = path
+        self.session: aiohttp.ClientSession | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-worker state and counters (for the front's health endpoint)."""
+        return {str(worker.index): worker.stats() for worker in self.workers}
+
+    async def start(self) -> None:
+        self._stopping = False
+        self.session = aiohttp.ClientSession()
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._run_worker(worker), name=f"supervise-{worker.index}") for worker in self.workers
+        ]
+
+    async def _spawn(self, worker: Worker) -> None:
+        env = dict(
+            os.environ,
+            BOT_WORKER_INDEX=str(worker.index),
+            WEBAPP_HOST="127.0.0.1",
+            WEBAPP_PORT=str(worker.port),
+        )
+        # Own session: Ctrl+C in a terminal reaches the front only, which then stops the workers in order
+        worker.process = await asyncio.create_subprocess_exec(*worker.command, env=env, start_new_session=True)
+        worker.started_at = time.monotonic()
+        logger.info(f"Worker {worker.index} started (pid {worker.process.pid}, port {worker.port})")
+        worker.ready = await self._wait_ready(worker)
+
+    async def _wait_ready(self, worker: Worker) -> bool:
+        """Wait until the worker accepts connections (or exits)."""
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while time.monotonic() < deadline and worker.process.returncode is None:
+            try:
+                async with self.session.get(worker.url("/health"), timeout=aiohttp.ClientTimeout(total=1)):
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                await asyncio.sleep(0.2)
+        return False
+
+    async def _run_worker(self, worker: Worker) -> None:
+        while not self._stopping:
+            await self._spawn(worker)
+            code = await worker.process.wait()
+            worker.ready = False
+            if self._stopping:
+                return
+            if worker.restart_requested:
+                worker.restart_requested = False
+                worker.restarts += 1
+                continue
+            worker.crashes = 1 if time.monotonic() - worker.started_at > STABLE_AFTER else worker.crashes + 1
+            delay = min(RESTART_BACKOFF_MAX, 2.0 ** (worker.crashes - 1))
+            logger.error(f"Worker {worker.index} exited with code {code}, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            worker.restarts += 1
+
+    async def _terminate(self, worker: Worker) -> None:
+        """SIGTERM (the worker handles its queued updates and exits), SIGKILL after WORKER_STOP_TIMEOUT."""
+        process = worker.process
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Worker {worker.index} did not stop in {WORKER_STOP_TIMEOUT:.0f}s, killing it")
+            process.kill()
+            await process.wait()
+
+    async def rolling_restart(self) -> None:
+        """Restart the workers one at a time, each once the previous one is ready again."""
+        for worker in self.workers:
+            logger.info(f"Restarting worker {worker.index}")
+            old = worker.process
+            worker.restart_requested = True
+            await self._terminate(worker)
+            deadline = time.monotonic() + WORKER_START_TIMEOUT
+            while not (worker.ready and worker.process is not old) and time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        await asyncio.gather(*(self._terminate(worker) for worker in self.workers))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+
+    async def forward(self, body: bytes, secret: str | None) -> web.Response:
+        """Send a raw update to its worker and relay the worker's answer."""
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        if not isinstance(update, dict):
+            return web.Response(body="Bad Request", status=400)
+        worker = self.workers[route(update, len(self.workers))]
+        if not worker.ready:
+            worker.failed += 1
+            return web.Response(body="Worker restarting", status=503)
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers[SECRET_HEADER] = secret
+        try:
+            async with self.session.post(
+                worker.url(self.path), data=body, headers=headers,
+                timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT),
+            ) as resp:
+                payload = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            worker.failed += 1
+            logger.warning(f"Forwarding update {update.get('update_id')} to worker {worker.index} failed: {e}")
+            return web.Response(body="Worker unavailable", status=503)
+        worker.forwarded += 1
+        return web.Response(body=payload, status=resp.status, content_type=resp.content_type)
+
+
+def create_front_app(supervisor: Supervisor) -> web.Application:
+    """aiohttp application of the front process."""
+    app = web.Application()
+
+    async def webhook(request: web.Request):
+        return await supervisor.forward(await request.read(), request.headers.get(SECRET_HEADER))
+
+    async def health(request: web.Request):
+        return web.json_response({"status": "ok", "workers": supervisor.stats()})
+
+    async def on_startup(app: web.Application):
+        await supervisor.start()
+
+    async def on_cleanup(app: web.Application):
+        await supervisor.stop()
+
+    app.router.add_post(supervisor.path, webhook)
+    app.router.add_get("/", health)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def main():
+    """Run the front until SIGTERM/SIGINT; SIGHUP restarts the workers one by one."""
+    supervisor = Supervisor()
+    runner = web.AppRunner(create_front_app(supervisor))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    logger.info(f"Starting front on {WEBAPP_HOST}:{WEBAPP_PORT} with {len(supervisor.workers)} workers")
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(supervisor.rolling_restart()))
+    await stop.wait()
+    logger.info("Stopping front and workers")
+    # Stops accepting webhook requests first, then the workers (on_cleanup)
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Background delivery of staff notifications from the outbox table.
+
+Handlers save an application, ticket or lead together with its outbox rows
+(db.Notification, one row per recipient chat) and answer the user right
+after the commit; OutboxWorker sends the notifications afterwards. Failed
+sends are retried with exponential backoff, rows interrupted by a crash are
+picked up again at startup (or, while running, once they have been
+'sending' for OUTBOX_CLAIM_TIMEOUT), and a row resumes at the first step it
+has not delivered yet. Delivery is at-least-once: a step sent just before a crash
+may be sent again.
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, Dict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Rows claimed (and sent concurrently) per round
+OUTBOX_BATCH_SIZE = 20
+# Give up on a row after this many failed attempts
+OUTBOX_MAX_ATTEMPTS = 10
+# Retry delay: OUTBOX_RETRY_BASE * 2^(attempt-1), capped, with +-20% jitter
+OUTBOX_RETRY_BASE = 5.0
+OUTBOX_RETRY_MAX = 3600.0
+# Look for due rows at least this often even without a wake() (e.g. rows
+# written by another process)
+OUTBOX_IDLE_POLL = 60.0
+# A row still 'sending' this long after its claim lost its outcome (e.g. the
+# write failed): claim it again. Far longer than any round of sends takes.
+OUTBOX_CLAIM_TIMEOUT = 600.0
+
+# Bot methods a step may call
+SEND_METHODS = {"send_message", "send_photo", "send_document", "send_voice"}
+# Errors that a retry cannot fix (bot blocked or kicked, chat or file not found)
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, ValueError)
+
+
+class OutboxWorker:
+    """Drains the outbox table; start() at startup, wake() after each commit that queued rows."""
+
+    def __init__(self):
+        self.bot: Bot | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.idle_poll = OUTBOX_IDLE_POLL
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.fallbacks = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Delivery counters (for the health endpoint)."""
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "fallbacks": self.fallbacks}
+
+    async def start(self, bot: Bot, idle_poll: float = OUTBOX_IDLE_POLL) -> None:
+        """
+        Recover rows left 'sending' by a crash and start the delivery task.
+        Use a short `idle_poll` when other processes queue rows (they cannot wake() this one).
+        """
+        self.bot = bot
+        self.idle_poll = idle_poll
+        self._stopping = False
+        self._wake = asyncio.Event()
+        recovered = await db.recover_outbox_async()
+        if recovered:
+            logger.warning(f"Outbox: {recovered} interrupted deliveries will be retried")
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="outbox-worker")
+
+    def wake(self) -> None:
+        """New rows were committed: look for work now instead of at the next poll."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let the current round finish (up to `timeout` seconds), then stop."""
+        if self._task is None or self._task.done():
+            return
+        self._stopping = True
+        self.wake()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            # Interrupted rows stay 'sending' until the next start or OUTBOX_CLAIM_TIMEOUT
+            logger.warning("Outbox: stop timed out, cancelling in-flight deliveries")
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                self._wake.clear()
+                rows = await db.claim_outbox_batch_async(time.time(), OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_TIMEOUT)
+                if rows:
+                    results = await asyncio.gather(*(self._deliver(*row) for row in rows), return_exceptions=True)
+                    for row, result in zip(rows, results):
+                        if isinstance(result, Exception):
+                            # Left 'sending': claimed again after OUTBOX_CLAIM_TIMEOUT
+                            logger.error(f"Outbox #{row[0]}: outcome not recorded: {result}")
+                    continue
+                next_at = await db.next_outbox_attempt_at_async()
+                timeout = self.idle_poll if next_at is None else min(self.idle_poll, next_at - time.time())
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except Exception as e:
+                logger.exception(f"Outbox worker error: {e}")
+                await asyncio.sleep(OUTBOX_RETRY_BASE)
+
+    async def _send(self, chat_id: int, step: Dict[str, Any]) -> None:
+        args = dict(step)
+        method = args.pop("method")
+        if method not in SEND_METHODS:
+            raise ValueError(f"Unsupported outbox method: {method}")
+        await getattr(self.bot, method)(chat_id=chat_id, **args)
+
+    async def _deliver(self, outbox_id: int, chat_id: int, steps_json: str, steps_done: int, attempts: int) -> None:
+        """Send the remaining steps of one row and record the outcome."""
+        try:
+            for step in json.loads(steps_json)[steps_done:]:
+                try:
+                    await self._send(chat_id, step)
+                except TelegramBadRequest as e:
+                    if not step.get("caption"):
+                        raise
+                    # Bad or expired file_id: the caption still goes out as text, then the remaining steps
+                    self.fallbacks += 1
+                    logger.warning(f"Outbox #{outbox_id} to {chat_id}: {step['method']} failed ({e}), sending the caption as text")
+                    await self._send(chat_id, {"method": "send_message", "text": step["caption"]})
+                steps_done += 1
+        except PERMANENT_ERRORS as e:
+            self.failed += 1
+            logger.error(f"Outbox #{outbox_id} to {chat_id} failed permanently: {e}")
+            await self._record(outbox_id, "failed", steps_done, attempts + 1, last_error=str(e))
+        except Exception as e:
+            attempts += 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                self.failed += 1
+                logger.error(f"Outbox #{outbox_id} to {chat_id} failed after {attempts} attempts: {e}")
+                await self._record(outbox_id, "failed", steps_done, attempts, last_error=str(e))
+                return
+            delay = _backoff(attempts)
+            if isinstance(e, TelegramRetryAfter):
+                delay = max(delay, e.retry_after)
+            self.retried += 1
+            logger.warning(f"Outbox #{outbox_id} to {chat_id}: attempt {attempts} failed ({e}), retry in {delay:.0f}s")
+            await self._record(
+                outbox_id, "pending", steps_done, attempts, next_attempt_at=time.time() + delay, last_error=str(e)
+            )
+        else:
+            self.sent += 1
+            await self._record(outbox_id, "sent", steps_done, attempts + 1)
+
+    async def _record(
+        self,
+        outbox_id: int,
+        status: str,
+        steps_done: int,
+        attempts: int,
+        next_attempt_at: float | None = None,
+        last_error: str | None = None,
+    ) -> None:
+        """
+        Save a delivery outcome. If that write fails, put the row back to
+        'pending' with backoff instead of leaving it 'sending'; it resumes at
+        steps_done, so nothing already delivered is sent again.
+        """
+        try:
+            await db.update_outbox_async(outbox_id, status, steps_done, attempts, next_attempt_at, last_error)
+        except Exception as e:
+            logger.error(f"Outbox #{outbox_id}: recording '{status}' failed ({e}), releasing the row")
+            await db.update_outbox_async(
+                outbox_id, "pending", steps_done, attempts, next_attempt_at=time.time() + _backoff(attempts), last_error=str(e)
+            )
+
+
+def _backoff(attempts: int) -> float:
+    """Retry delay after `attempts` failed attempts (exponential, capped, with jitter)."""
+    return min(OUTBOX_RETRY_MAX, OUTBOX_RETRY_BASE * 2 ** (max(attempts, 1) - 1)) * random.uniform(0.8, 1.2)
+
+
+outbox_worker = OutboxWorker()
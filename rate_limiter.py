@@ -0,0 +1,182 @@
+"""
+Outgoing Bot API rate limiting for the aiogram bot.
+
+Telegram allows roughly 30 messages per second overall, 20 per minute in
+one group and about one per second in one private chat. RateLimiter is a
+Bot session middleware that keeps every call with a chat_id under those
+limits by making it wait for its turn instead of failing, and retries
+calls rejected with 429 (TelegramRetryAfter) after the delay Telegram asks for.
+"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Dict
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import (
+    RATE_LIMIT_GLOBAL_PER_SEC,
+    RATE_LIMIT_GROUP_PER_MIN,
+    RATE_LIMIT_PRIVATE_PER_SEC,
+    RATE_LIMIT_MAX_RETRIES,
+)
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+# Burst allowed in one private chat before calls are spaced out
+PRIVATE_CHAT_BURST = 3
+# Forget idle per-chat buckets once there are more than this many
+CHAT_BUCKETS_PRUNE_AT = 5000
+
+
+class TokenBucket:
+    """
+    Token bucket with reservations: reserve() always takes a token, letting
+    the balance go negative, and returns how long the caller has to wait
+    for it. Waiters are therefore served in the order they reserved.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return the seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, now: float, seconds: float) -> None:
+        """Make the next token available no sooner than `seconds` from now (after a 429)."""
+        self._refill(now)
+        # The next reserve() takes one token, leaving -seconds * rate: a wait of exactly `seconds`
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_idle(self, now: float) -> bool:
+        """True if the bucket would be full now (it can be recreated without changing behaviour)."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter(BaseRequestMiddleware):
+    """
+    Bot session middleware: global and per-chat token buckets plus 429 retries.
+    Register with bot.session.middleware(RateLimiter()).
+    """
+
+    def __init__(
+        self,
+        global_per_sec: float = RATE_LIMIT_GLOBAL_PER_SEC,
+        group_per_min: float = RATE_LIMIT_GROUP_PER_MIN,
+        private_per_sec: float = RATE_LIMIT_PRIVATE_PER_SEC,
+        max_retries: int = RATE_LIMIT_MAX_RETRIES,
+    ):
+        self.global_bucket = TokenBucket(global_per_sec, global_per_sec)
+        self.group_per_min = group_per_min
+        self.private_per_sec = private_per_sec
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        # Metrics
+        self.waiting = 0
+        self.max_waiting = 0
+        self.requests = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.retries = 0
+        self.failed_after_retries = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and wait-time metrics (for the health endpoint)."""
+        return {
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "requests": self.requests,
+            "delayed": self.delayed,
+            "avg_wait": round(self.total_wait / self.delayed, 3) if self.delayed else 0.0,
+            "max_wait": round(self.max_wait, 3),
+            "retries": self.retries,
+            "failed_after_retries": self.failed_after_retries,
+            "chat_buckets": len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_PRUNE_AT:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_idle(now)}
+            # Groups, supergroups and channels have negative ids (or an @username)
+            if isinstance(chat_id, str) or chat_id < 0:
+                rate = self.group_per_min / 60
+                bucket = TokenBucket(rate, self.group_per_min)
+            else:
+                bucket = TokenBucket(self.private_per_sec, PRIVATE_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_turn(self, chat_id: Any) -> None:
+        """Wait for a per-chat token, then for a global one."""
+        start = time.monotonic()
+        chat_wait = self._chat_bucket(chat_id, start).reserve(start)
+        global_wait = 0.0
+        if chat_wait <= 0:
+            global_wait = self.global_bucket.reserve(start)
+            if global_wait <= 0:
+                return
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            if chat_wait > 0:
+                await asyncio.sleep(chat_wait)
+                # Take the global token only once it is this chat's turn
+                global_wait = self.global_bucket.reserve(time.monotonic())
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - start
+        self.delayed += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        self.requests += 1
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.failed_after_retries += 1
+                    raise
+                self.retries += 1
+                logger.warning(
+                    f"Flood control on {type(method).__name__} to {chat_id}: "
+                    f"retry {attempt}/{self.max_retries} in {e.retry_after}s"
+                )
+                now = time.monotonic()
+                self._chat_bucket(chat_id, now).block(now, e.retry_after)
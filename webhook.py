@@ -0,0 +1,229 @@
+"""
+Ack-first webhook ingestion for the aiogram bot.
+
+QueuedRequestHandler checks the secret, queues the update and answers 200
+at once; a pool of worker tasks feeds queued updates to the dispatcher.
+A slow handler (an export, a fan-out to several chats) therefore never holds
+the webhook connection, so Telegram does not retry or slow down delivery
+for everyone else.
+
+Updates of one chat are handled strictly in order, one at a time (FSM
+steps depend on it); different chats are handled in parallel. At most
+WEBHOOK_QUEUE_SIZE updates are queued: beyond that the webhook answers 503
+and Telegram redelivers the update later. Redelivered updates that were
+already queued are dropped (ingress.UpdateDeduplicator), and so are
+updates no handler is interested in (ingress.UpdateFilter), before the
+dispatcher parses them or looks up FSM state.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT
+from ingress import UpdateDeduplicator, UpdateFilter, update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue:
+    """
+    Bounded queue of raw updates, ordered per chat.
+
+    Each chat with pending updates has a FIFO in `_chats`; `_ready` holds
+    the chats whose next update may be handled. A worker takes a chat,
+    handles its oldest update and, if more are waiting, puts the chat back
+    at the end of `_ready`, so busy chats take turns with the others and a
+    chat is never handled by two workers at once.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Dict[str, Any]], Awaitable[None]],
+        workers: int = WEBHOOK_WORKERS,
+        max_pending: int = WEBHOOK_QUEUE_SIZE,
+    ):
+        self._process = process
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._chats: Dict[Any, Deque[Tuple[Dict[str, Any], float]]] = {}
+        self._ready: asyncio.Queue | None = None
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+        # Metrics
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, overflow and latency metrics (for the health endpoint)."""
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending_seen,
+            "chats": len(self._chats),
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait": round(self.total_wait / self.processed, 3) if self.processed else 0.0,
+            "max_wait": round(self.max_wait, 3),
+        }
+
+    def start(self) -> None:
+        """Start the worker tasks (in the running loop)."""
+        self._closing = False
+        self._ready = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(), name=f"webhook-worker-{i}") for i in range(self.workers)]
+
+    def put(self, update: Dict[str, Any]) -> bool:
+        """Queue an update; False if the queue is full or closing."""
+        if self._ready is None or self._closing or self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        key = update_chat_id(update)
+        if key is None:
+            # Belongs to no chat: no ordering to keep
+            key = ("update", update.get("update_id"))
+        self.received += 1
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        item = (update, time.monotonic())
+        waiting = self._chats.get(key)
+        if waiting is None:
+            self._chats[key] = deque((item,))
+            self._ready.put_nowait(key)
+        else:
+            waiting.append(item)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            waiting = self._chats[key]
+            # The update stays at the head while it is handled, so newer ones queue behind it
+            update, queued_at = waiting[0]
+            waited = time.monotonic() - queued_at
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            try:
+                await self._process(update)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Error handling update {update.get('update_id')}: {e}")
+            finally:
+                waiting.popleft()
+                self.pending -= 1
+                self.processed += 1
+                if waiting:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                self._ready.task_done()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop accepting updates, give queued ones up to `timeout` seconds, then stop the workers."""
+        self._closing = True
+        if self._ready is not None and self.pending:
+            try:
+                await asyncio.wait_for(self._ready.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Webhook queue: {self.pending} updates dropped at shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    SimpleRequestHandler that answers right after queueing the update
+    (see UpdateQueue). Register with .register(app, path=WEBHOOK_PATH).
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        secret_token: str | None = None,
+        workers: int = WEBHOOK_WORKERS,
+        max_pending: int = WEBHOOK_QUEUE_SIZE,
+        dedup: UpdateDeduplicator | None = None,
+        update_filter: UpdateFilter | None = None,
+        **data: Any,
+    ):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.queue = UpdateQueue(self._feed_update, workers, max_pending)
+        # In memory is enough here: one process, and queued updates are handled before it exits
+        self.dedup = dedup or UpdateDeduplicator()
+        self.update_filter = update_filter
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        """
+        Add the route and the lifecycle hooks: workers start at startup; at
+        shutdown the queue is drained (register before other shutdown hooks,
+        so they run after it), and the bot session is closed at cleanup,
+        after every shutdown hook that may still send something.
+        """
+        app.router.add_route("POST", path, self.handle, **kwargs)
+        app.on_startup.append(self._handle_startup)
+        app.on_shutdown.append(self._handle_drain)
+        app.on_cleanup.append(self._handle_close)
+
+    async def _handle_startup(self, app: web.Application) -> None:
+        self.queue.start()
+
+    async def _handle_drain(self, app: web.Application) -> None:
+        await self.drain()
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """Handle the updates already queued (up to `timeout` seconds) and stop the workers."""
+        if self.queue.pending:
+            logger.info(f"Draining {self.queue.pending} queued updates")
+        await self.queue.stop(timeout)
+
+    async def _feed_update(self, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        # A handler may return a method to call ("reply in webhook"): too late for that, call it
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        if not isinstance(update, dict):
+            return web.Response(body="Bad Request", status=400)
+        if self.update_filter is not None and not self.update_filter.accepts(update):
+            return web.json_response({}, dumps=bot.session.json_dumps)
+        update_id = update.get("update_id")
+        if self.dedup.seen(update_id):
+            logger.info(f"Duplicate update {update_id} dropped")
+            return web.json_response({}, dumps=bot.session.json_dumps)
+        if not self.queue.put(update):
+            self.dedup.forget(update_id)
+            logger.warning(f"Webhook queue full, update {update_id} rejected")
+            return web.Response(body="Busy", status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
+
+    async def close(self) -> None:
+        """Handle what is queued (if not drained yet), then close the bot session."""
+        await self.drain()
+        await super().close()